@@ -9,7 +9,7 @@ bl_info = {
     "location": "File > Import",
     "category": "Import-Export"}
 
-import bpy, enum, io, math, mathutils, os, struct, time
+import bpy, collections, enum, hashlib, io, json, math, mathutils, mmap, multiprocessing, numpy, os, pickle, struct, sys, time
 
 class AnimTrack:
     def __init__(self):
@@ -20,10 +20,101 @@ class AnimTrack:
         self.dataOffset = 0
         self.dataSize = 0
         self.animations = []
+        self.frameTimes = None # Position of every decoded frame from the start of its chunk, once it has been resampled
 
     def __repr__(self):
         return "Node name: " + str(self.name) + "\t| Type: " + str(self.type) + "\t| Flags: " + str(self.flags) + "\t| # of frames: " + str(self.frameCount) + "\t| Data offset: " + str(self.dataOffset) + "\t| Data size: " + str(self.dataSize) + "\n"
 
+class AnimData:
+    def __init__(self):
+        self.name = ""
+        self.path = "" # File the animation was read from
+        self.frameCount = 0
+        self.frameStart = 0 # Index of the first decoded frame, when only part of the file was decoded
+        self.frameStep = 1 # Number of source frames between resampled frames
+        self.frameTotal = 0 # Number of frames in the whole file
+        self.bufferOffset = 0 # Position of the data of every track in the file
+        self.bufferSize = 0
+        self.groups = {}
+        # Structure of this dict is: {AnimType (numeric): an array of AnimTrack objects}
+
+    # Yields (index of the first frame, groups) for every piece of the animation; an animation that was
+    # decoded all at once is a single piece
+    def chunks(self):
+        yield self.frameStart, resampleGroups(self.groups, self.frameStart, self.frameStart, self.frameStart + int(self.frameCount), self.frameStep)
+
+    # Returns the names of the transform tracks whose scale is something other than 1 on any frame
+    def getScaledTrackNames(self):
+        return getScaledTrackNames(self.groups.get(AnimType.Transform.value, []))
+
+    def __repr__(self):
+        return "Anim name: " + str(self.name) + "\t| # of frames: " + str(self.frameCount) + "\t| # of groups: " + str(len(self.groups)) + "\n"
+
+# A read-only view over part of a file mapping that behaves like a file, so that track data can be read
+# without copying the whole buffer first
+class BufferView:
+    def __init__(self, mapping, offset, size):
+        self.mapping = mapping
+        self.offset = offset
+        self.size = size
+        self.position = 0
+
+    def seek(self, position, whence=0):
+        if (whence == 1):
+            position += self.position
+        elif (whence == 2):
+            position += self.size
+        self.position = position
+        return self.position
+
+    def tell(self):
+        return self.position
+
+    def read(self, size=-1):
+        end = self.size if (size < 0) else min(self.size, self.position + size)
+        data = self.mapping[self.offset + self.position:self.offset + end]
+        self.position = max(self.position, end)
+        return data
+
+    def close(self):
+        pass
+
+# An animation whose tracks are decoded a chunk of frames at a time, straight from a mapping of the file;
+# only the chunk that is currently being imported is kept in memory
+class AnimStream(AnimData):
+    def __init__(self, animPath, chunkSize):
+        AnimData.__init__(self)
+        self.path = animPath
+        self.chunkSize = chunkSize
+
+    # Yields (index of the first frame, groups) for every chunk of the given groups, decoded but not resampled
+    def readChunks(self, groups):
+        with open(self.path, 'rb') as am, mmap.mmap(am.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            ao = BufferView(mm, self.bufferOffset, self.bufferSize)
+            frameEnd = self.frameStart + self.frameCount
+            for chunkStart in range(self.frameStart, frameEnd, self.chunkSize):
+                chunkGroups = {}
+                for animType, tracks in groups.items():
+                    # Constant tracks only have a single frame, which belongs to the first chunk
+                    chunkGroups[animType] = [copyTrackHeader(track) for track in tracks
+                                             if (chunkStart == self.frameStart or not isConstantTrack(track))]
+                readAnimations(ao, chunkGroups, (chunkStart, min(chunkStart + self.chunkSize, frameEnd)))
+                yield chunkStart, chunkGroups
+
+    def chunks(self):
+        for chunkStart, chunkGroups in self.readChunks(self.groups):
+            yield chunkStart, resampleGroups(chunkGroups, chunkStart, self.frameStart, self.frameStart + self.frameCount, self.frameStep)
+
+    # Scale has to be known for the whole animation before its first chunk is keyed, so the transform tracks are
+    # read through once beforehand; tracks that are found to be scaled aren't read again
+    def getScaledTrackNames(self):
+        names = set()
+        tracks = list(self.groups.get(AnimType.Transform.value, []))
+        for chunkStart, chunkGroups in self.readChunks({AnimType.Transform.value: tracks}):
+            names.update(getScaledTrackNames(chunkGroups[AnimType.Transform.value]))
+            tracks[:] = [track for track in tracks if track.name not in names]
+        return names
+
 class AnimCompressedHeader:
     def __init__(self):
         self.unk_4 = 0 # always 4?
@@ -70,6 +161,26 @@ class AnimTrackFlags(enum.Enum):
     # Use 65280 or 0xff00 when performing a bitwise 'and' on a flag
     # Use 255 or 0x00ff when performing a bitwise 'and' on a flag, for uncompressed data
 
+# Values of Keyframe.interpolation, as foreach_get() and foreach_set() read and write them
+class KeyInterpolation(enum.Enum):
+    Constant = 0
+    Linear = 1
+    Bezier = 2
+
+def isConstantTrack(track):
+    return ((track.flags & 0xff00) == AnimTrackFlags.Constant.value or (track.flags & 0xff00) == AnimTrackFlags.ConstTransform.value)
+
+# Copies everything about a track but its decoded frames
+def copyTrackHeader(track):
+    at = AnimTrack()
+    at.name = track.name
+    at.type = track.type
+    at.flags = track.flags
+    at.frameCount = track.frameCount
+    at.dataOffset = track.dataOffset
+    at.dataSize = track.dataSize
+    return at
+
 def readVarLenString(file):
     nameBuffer = []
     while('\x00' not in nameBuffer):
@@ -77,50 +188,274 @@ def readVarLenString(file):
     del nameBuffer[-1]
     return ''.join(nameBuffer)
 
-# Utility function to read from a buffer by bits, as Python can only read by bytes
-def readBits(buffer, bitCount, bitPosition):
-    bee = struct.unpack('<B', buffer.read(1))[0] # Peek at next byte
-    buffer.seek(-1, 1) # Go back one byte
-    value = 0
-    LE = 0
-    bitIndex = 0
-    for i in range(bitCount):
-        bit = (bee & (0x1 << bitPosition)) >> bitPosition
-        value = value | (bit << (LE + bitIndex))
-        bitPosition += 1
-        bitIndex += 1
-        if (bitPosition >= 8):
-            bitPosition = 0
-            buffer.seek(1, 1) # Go forward one byte
-            bee = struct.unpack('<B', buffer.read(1))[0] # Peek at next byte
-            buffer.seek(-1, 1) # Go back one byte
-
-        if (bitIndex >= 8):
-            bitIndex = 0
-            if ((LE + 8) > bitCount):
-                LE = bitCount - 1
-            else:
-                LE += 8
-
-    # Also return the bitPosition so that it can be reused by another call to this function
-    return value, bitPosition
+# Flips the sign of quaternions (rows of [X, Y, Z, W]) so that every quaternion lies in the same
+# hemisphere as the one before it; both signs describe the same rotation, but only continuous signs
+# can be interpolated linearly
+def fixQuaternionSigns(rotations):
+    if (len(rotations) < 2):
+        return rotations
+    dots = numpy.sum(rotations[1:] * rotations[:-1], axis=1)
+    rotations[1:] *= numpy.cumprod(numpy.where(dots < 0, -1.0, 1.0))[:, numpy.newaxis]
+    return rotations
+
+# Returns the indices of the frames to keep so that linearly interpolating between them reproduces
+# every dropped frame within the tolerance, for every channel (column) of the given array
+def reduceKeyframes(values, tolerance):
+    values = numpy.asarray(values, dtype=numpy.float64).reshape(len(values), -1)
+    frameCount = len(values)
+    if (frameCount <= 2):
+        return numpy.arange(frameCount)
+
+    keep = numpy.zeros(frameCount, dtype=bool)
+    keep[0] = keep[-1] = True
+    # Iterative Ramer-Douglas-Peucker: split every segment at its worst frame until all frames fit
+    segments = [(0, frameCount - 1)]
+    while segments:
+        a, b = segments.pop()
+        if (b - a < 2):
+            continue
+        mu = (numpy.arange(a + 1, b) - a) / float(b - a)
+        interpolated = values[a] + (values[b] - values[a]) * mu[:, numpy.newaxis]
+        error = numpy.abs(values[a + 1:b] - interpolated).max(axis=1)
+        worst = int(numpy.argmax(error))
+        if (error[worst] > tolerance):
+            split = a + 1 + worst
+            keep[split] = True
+            segments.append((a, split))
+            segments.append((split, b))
+
+    return numpy.flatnonzero(keep)
+
+# Boolean and other stepped values only need a keyframe wherever the value changes
+def reduceSteppedKeyframes(values):
+    values = numpy.asarray(values)
+    if (len(values) == 0):
+        return numpy.arange(0)
+    changed = numpy.ones(len(values), dtype=bool)
+    changed[1:] = values[1:] != values[:-1]
+    return numpy.flatnonzero(changed)
+
+# Returns the set of frame indices that should be keyed for a decoded track
+def getTrackKeyframes(track, tolerance):
+    if (len(track.animations) == 0):
+        return set()
 
-# A standard linear interpolation function for individual values
-def lerp(av, bv, v0, v1, factor):
-    if (v0 == v1):
-        return av
-    if (factor == v0):
-        return av
-    if (factor == v1):
-        return bv
+    if ((track.flags & 0x00ff) == AnimTrackFlags.Transform.value):
+        # Position [X, Y, Z], Rotation [X, Y, Z, W], Scale [X, Y, Z]
+        transforms = getTransformArray(track)
+        rotations = fixQuaternionSigns(transforms[:, 1, :].copy())
+        kept = reduceKeyframes(numpy.hstack((transforms[:, 0, :3], rotations, transforms[:, 2, :3])), tolerance)
+    elif ((track.flags & 0x00ff) in (AnimTrackFlags.Boolean.value, AnimTrackFlags.PatternIndex.value)):
+        kept = reduceSteppedKeyframes(track.animations)
+    else:
+        kept = reduceKeyframes([numpy.ravel(v) for v in track.animations], tolerance)
+
+    return set(kept.tolist())
+
+# Returns the indices of the frames of a track that get keyed, in order
+def getKeyedFrames(track, reduce_keyframes, reduce_tolerance):
+    if reduce_keyframes:
+        return numpy.array(sorted(getTrackKeyframes(track, reduce_tolerance)), dtype=numpy.int64)
+    return numpy.arange(len(track.animations))
+
+# Returns the decoded frames of a transform track as an array of shape (frames, 3, 4):
+# rows of Position [X, Y, Z, W], Rotation [X, Y, Z, W] and Scale [X, Y, Z, SW]
+def getTransformArray(track):
+    return numpy.array([[list(row) for row in m] for m in track.animations], dtype=numpy.float64).reshape(-1, 3, 4)
+
+# Returns the position of every decoded frame of a track from the start of its chunk
+def getFrameTimes(track):
+    if (track.frameTimes is not None):
+        return track.frameTimes
+    return numpy.arange(len(track.animations))
+
+# Spherically interpolates between two arrays of quaternions (rows of [X, Y, Z, W]), the short way around
+def slerpQuaternions(a, b, mu):
+    dots = numpy.sum(a * b, axis=1)
+    b = numpy.where(dots[:, numpy.newaxis] < 0, -b, b)
+    theta = numpy.arccos(numpy.clip(numpy.abs(dots), 0, 1))
+    sinTheta = numpy.sin(theta)
+    # Nearly identical quaternions are interpolated linearly instead, which is what slerp tends to anyway
+    small = sinTheta < 1e-6
+    sinTheta = numpy.where(small, 1, sinTheta)
+    wa = numpy.where(small, 1 - mu, numpy.sin((1 - mu) * theta) / sinTheta)
+    wb = numpy.where(small, mu, numpy.sin(mu * theta) / sinTheta)
+    return (a * wa[:, numpy.newaxis]) + (b * wb[:, numpy.newaxis])
+
+# Returns a copy of a track holding its values at the given (fractional) frames: transforms are interpolated
+# with slerp for rotations, booleans and pattern indices hold their previous frame, and anything else is interpolated linearly
+def resampleTrack(track, times):
+    at = copyTrackHeader(track)
+    at.frameTimes = times
+    lower = numpy.floor(times).astype(numpy.int64)
+    upper = numpy.minimum(lower + 1, len(track.animations) - 1)
+    mu = times - lower
 
-    mu = (factor - v0) / (v1 - v0)
-    return (av * (1 - mu)) + (bv * mu)
+    if ((track.flags & 0x00ff) == AnimTrackFlags.Transform.value):
+        transforms = getTransformArray(track)
+        a, b = transforms[lower], transforms[upper]
+        resampled = a + ((b - a) * mu[:, numpy.newaxis, numpy.newaxis])
+        resampled[:, 1, :] = slerpQuaternions(a[:, 1, :], b[:, 1, :], mu)
+        at.animations = [mathutils.Matrix(m) for m in resampled.tolist()]
+    elif ((track.flags & 0x00ff) in (AnimTrackFlags.Boolean.value, AnimTrackFlags.PatternIndex.value)):
+        at.animations = [track.animations[i] for i in lower.tolist()]
+    else:
+        values = numpy.array([numpy.ravel(v) for v in track.animations], dtype=numpy.float64)
+        resampled = values[lower] + ((values[upper] - values[lower]) * mu[:, numpy.newaxis])
+        if ((track.flags & 0x00ff) == AnimTrackFlags.Float.value):
+            at.animations = resampled[:, 0].tolist()
+        else:
+            at.animations = [mathutils.Vector(v) for v in resampled.tolist()]
+
+    at.frameCount = len(at.animations)
+    return at
+
+# Resamples a chunk of decoded tracks every frameStep frames, on a grid that starts at the first frame of the
+# animation; the last frame of the animation is always kept so that it still ends on the right pose.
+# A position between the last frame of a chunk and the first frame of the next one holds the former
+def resampleGroups(animGroups, chunkStart, frameStart, frameEnd, frameStep):
+    if (frameStep == 1):
+        return animGroups
+
+    chunkLength = max([len(track.animations) for tracks in animGroups.values() for track in tracks], default=0)
+    first = math.ceil((chunkStart - frameStart) / frameStep - 1e-6)
+    last = math.ceil((chunkStart + chunkLength - frameStart) / frameStep - 1e-6) - 1
+    times = numpy.clip(frameStart + (numpy.arange(first, last + 1) * frameStep) - chunkStart, 0, None)
+    if (chunkStart + chunkLength == frameEnd):
+        times = times[times < chunkLength - 1]
+        times = numpy.append(times, chunkLength - 1)
+
+    resampledGroups = {}
+    for animType, tracks in animGroups.items():
+        resampledGroups[animType] = []
+        for track in tracks:
+            # Constant tracks only have a single frame, which stays where it is
+            if (len(track.animations) <= 1):
+                resampledGroups[animType].append(track)
+                continue
+            resampledGroups[animType].append(resampleTrack(track, times[times < len(track.animations)]))
+    return resampledGroups
+
+# Sets the interpolation of the keyframes of an fcurve from the given one onwards in one bulk write
+def setKeyframeInterpolation(fcurve, interpolation, start=0):
+    keyframePoints = fcurve.keyframe_points
+    modes = numpy.zeros(len(keyframePoints), dtype=numpy.int32)
+    keyframePoints.foreach_get('interpolation', modes)
+    modes[start:] = interpolation.value
+    keyframePoints.foreach_set('interpolation', modes)
+
+# Reduced keyframes only reproduce the dropped frames when they're interpolated linearly
+def getKeyInterpolation(reduce_keyframes):
+    return KeyInterpolation.Linear if reduce_keyframes else None
+
+# Appends keyframes to an action's fcurve in one bulk write instead of one keyframe_insert per frame,
+# creating the fcurve the first time it is written to. New keyframes get the given interpolation, if any
+def writeFCurveKeyframes(action, dataPath, index, group, frames, values, interpolation=None):
+    if (len(frames) == 0):
+        return
+    fcurve = action.fcurves.find(dataPath, index=index)
+    if (fcurve is None):
+        fcurve = action.fcurves.new(dataPath, index=index, action_group=group)
+    keyframePoints = fcurve.keyframe_points
+    keyCount = len(keyframePoints)
+    keyframePoints.add(len(frames))
+    co = numpy.zeros((len(keyframePoints), 2), dtype=numpy.float32)
+    keyframePoints.foreach_get('co', co.ravel())
+    co[keyCount:, 0] = frames
+    co[keyCount:, 1] = values
+    keyframePoints.foreach_set('co', co.ravel())
+    if (interpolation is not None):
+        setKeyframeInterpolation(fcurve, interpolation, keyCount)
+    fcurve.update()
+
+# A list of strings to split object names with so that they can exactly match a given track name
+extendNames = ["_VIS_O_OBJ", "_NSC_O_OBJ", "_O_OBJ", "_MeshShape"]
+
+# Reads which helper bone is driven by which bone from the interpolation constraints of a NUHLPB file.
+# Structure of the returned dict is: {helper bone name: driver bone name}
+def readHelperBones(hlpbPath):
+    helperBones = {}
+    with open(hlpbPath, 'rb') as hb:
+        hb.seek(0x10, 0)
+        HlpbCheck = struct.unpack('<L', hb.read(4))[0]
+        if (HlpbCheck != 0x484C5042):
+            raise RuntimeError("%s is not a valid NUHLPB file." % hlpbPath)
+        HlpbVerA = struct.unpack('<H', hb.read(2))[0]
+        HlpbVerB = struct.unpack('<H', hb.read(2))[0]
+        hb.seek(0x10, 1) # Aim constraints, which aren't used here
+        InterpOffset = hb.tell() + struct.unpack('<L', hb.read(4))[0]; hb.seek(0x04, 1)
+        InterpCount = struct.unpack('<L', hb.read(4))[0]; hb.seek(0x04, 1)
+        for i in range(InterpCount):
+            # Every entry starts with offsets to its name, bone, root bone, parent bone and driver bone names
+            hb.seek(InterpOffset + (i * 0x70), 0)
+            NameOffsets = []
+            for n in range(5):
+                NameOffsets.append(hb.tell() + struct.unpack('<L', hb.read(4))[0]); hb.seek(0x04, 1)
+            hb.seek(NameOffsets[1], 0)
+            BoneName = readVarLenString(hb)
+            hb.seek(NameOffsets[4], 0)
+            DriverBoneName = readVarLenString(hb)
+            helperBones[BoneName] = DriverBoneName
+
+    print("Helper bones: " + str(helperBones))
+    return helperBones
+
+# Reads a table of helper bones written as "helper:driver, helper:driver, ..."
+def parseHelperBoneTable(table):
+    helperBones = {}
+    for entry in table.split(","):
+        if (":" not in entry):
+            continue
+        helperName, driverName = entry.split(":", 1)
+        helperBones[helperName.strip()] = driverName.strip()
+    return helperBones
+
+# Helper bones are loaded once for every import: from the given NUHLPB file, from a NUHLPB file next to
+# the animations, or else from the table
+def getHelperBones(animDir, nuhlpb_path, helper_bones):
+    hlpbPaths = [bpy.path.abspath(nuhlpb_path)] if nuhlpb_path else getHelperBoneFilePaths(animDir)
+    for hlpbPath in hlpbPaths:
+        if os.path.isfile(hlpbPath):
+            return readHelperBones(hlpbPath), hlpbPath
+    return parseHelperBoneTable(helper_bones), None
+
+# Where the NUHLPB file of the model can be for animations in animDir: next to them, or in the folder of the model
+# that matches theirs, such as fighter/mario/model/body/c00 for animations in fighter/mario/motion/body/c00
+def getHelperBoneFilePaths(animDir):
+    hlpbPaths = [os.path.join(animDir, "model.nuhlpb")]
+    parts = os.path.normpath(animDir).split(os.sep)
+    for i in reversed(range(len(parts))):
+        if (parts[i].lower() == "motion"):
+            hlpbPaths.append(os.path.join(os.sep.join(parts[:i] + ["model"] + parts[i + 1:]), "model.nuhlpb"))
+    return hlpbPaths
+
+# Returns extra tracks that make the helper bones of the armature share the frames of their driver's track
+def getHelperTracks(tracks, helperBones, obj):
+    tracksByName = {track.name: track for track in tracks}
+    helperTracks = []
+    for helperName, driverName in helperBones.items():
+        if (helperName in tracksByName or driverName not in tracksByName or obj.pose.bones.get(helperName) is None):
+            continue
+        at = copyTrackHeader(tracksByName[driverName])
+        at.name = helperName
+        at.animations = tracksByName[driverName].animations
+        at.frameTimes = tracksByName[driverName].frameTimes
+        helperTracks.append(at)
+    return helperTracks
+
+# Returns the names of the transform tracks whose scale is something other than 1 on any frame
+def getScaledTrackNames(tracks):
+    names = set()
+    for track in tracks:
+        if (len(track.animations) == 0):
+            continue
+        # Scale [X, Y, Z] of every frame
+        scales = numpy.array([m[2][:3] for m in track.animations])
+        if numpy.any(scales != 1):
+            names.add(track.name)
+    return names
 
 def getExactObjectName(objName, compare):
-    # A list of strings to split object names with so that they can exactly match a given track name
-    extendNames = ["_VIS_O_OBJ", "_NSC_O_OBJ", "_O_OBJ", "_MeshShape"]
-
     for term in extendNames:
         result = objName.split(term)[0]
         if (result == compare):
@@ -128,123 +463,545 @@ def getExactObjectName(objName, compare):
 
     return objName
 
-def getAnimationInfo(self, context, camera_selected, filepath, read_transform, read_material, read_visibility, read_camera):
-    # Semi-global variables used by this function's hierarchy; cleared every time this function runs
-    global AnimName; AnimName = ""
+# Returns every track name that getExactObjectName() would match with the given object name
+def getExactObjectNames(objName):
+    names = {objName.split(term)[0] for term in extendNames}
+    names.add(objName)
+    return names
+
+# Every name that a material track could use for the materials in the file; materials that share a name get
+# a number added to it by Blender, such as "EyeL.001"
+def getMaterialNames():
+    names = set()
+    for material in bpy.data.materials:
+        names.add(material.name)
+        baseName, dot, number = material.name.rpartition(".")
+        if (dot and len(number) >= 3 and number.isdigit()):
+            names.add(baseName)
+    return names
+
+# Decides which tracks are worth decoding, before any file is read. Structure of the returned dict is:
+# {AnimType (numeric): a set of track names to decode, or None to decode every track of that type};
+# types that are missing from the dict are not decoded at all
+def getTrackFilter(context, camera_selected, armatures, read_transform, read_material, read_visibility, read_camera, skip_unmatched):
+    trackFilter = {}
+    if (read_camera and camera_selected):
+        # importCamera() only looks at these two groups
+        trackFilter[AnimType.Transform.value] = None
+        trackFilter[AnimType.Camera.value] = None
+        return trackFilter
+
+    if read_transform:
+        boneNames = None
+        if skip_unmatched:
+            boneNames = set()
+            for armature in armatures:
+                boneNames |= set(armature.pose.bones.keys())
+        trackFilter[AnimType.Transform.value] = boneNames
+
+    if read_visibility:
+        visNames = None
+        if skip_unmatched:
+            visNames = set()
+            for target in bpy.data.objects:
+                if (target.type == 'MESH'):
+                    visNames |= getExactObjectNames(target.name)
+        trackFilter[AnimType.Visibility.value] = visNames
+
+    if read_material:
+        trackFilter[AnimType.Material.value] = getMaterialNames() if skip_unmatched else None
+
+    return trackFilter
+
+# Drops every track that the filter from getTrackFilter() doesn't want, so that it never gets decoded
+def filterTracks(animGroups, trackFilter):
+    for animType in list(animGroups.keys()):
+        if (animType not in trackFilter):
+            del animGroups[animType]
+            continue
+
+        names = trackFilter[animType]
+        if (names is not None):
+            animGroups[animType] = [track for track in animGroups[animType] if track.name in names]
+
+# Reads the header and the group and track tables of a NUANMB file into the given AnimData, and returns
+# the position and size of the buffer that holds the data of every track
+def readAnimationTables(am, anim, animPath):
     GroupCount = 0
-    global FrameCount; FrameCount = 0
     NodeCount = 0
-    global AnimGroups; AnimGroups = {}
-    # Structure of this dict is: {AnimType (numeric): an array of AnimTrack objects}
 
+    am.seek(0x10, 0)
+    AnimCheck = struct.unpack('<L', am.read(4))[0]
+    if (AnimCheck == 0x414E494D):
+        AnimVerA = struct.unpack('<H', am.read(2))[0]
+        AnimVerB = struct.unpack('<H', am.read(2))[0]
+        FinalFrameIndex = struct.unpack('<f', am.read(4))[0]
+        anim.frameCount = FinalFrameIndex + 1
+        anim.frameTotal = int(anim.frameCount)
+        print("Total # of frames: " + str(anim.frameCount))
+        print("Final frame index: " + str(FinalFrameIndex))
+        Unk1 = struct.unpack('<H', am.read(2))[0]
+        Unk2 = struct.unpack('<H', am.read(2))[0]
+        AnimNameOffset = am.tell() + struct.unpack('<L', am.read(4))[0]; am.seek(0x04, 1)
+        GroupOffset = am.tell() + struct.unpack('<L', am.read(4))[0]; am.seek(0x04, 1)
+        GroupCount = struct.unpack('<L', am.read(4))[0]; am.seek(0x04, 1)
+        BufferOffset = am.tell() + struct.unpack('<L', am.read(4))[0]; am.seek(0x04, 1)
+        BufferSize = struct.unpack('<L', am.read(4))[0]; am.seek(0x04, 1)
+        print("GroupOffset: " + str(GroupOffset) + " | " + "GroupCount: " + str(GroupCount) + " | " + "BufferOffset: " + str(BufferOffset) + " | " + "BufferSize: " + str(BufferSize))
+        am.seek(AnimNameOffset, 0)
+        anim.name = readVarLenString(am); am.seek(0x04, 1)
+        print("AnimName: " + anim.name)
+        am.seek(GroupOffset, 0)
+        # Collect information about the nodes
+        for g in range(GroupCount):
+            NodeAnimType = struct.unpack('<L', am.read(4))[0]; am.seek(0x04, 1)
+            NodeOffset = am.tell() + struct.unpack('<L', am.read(4))[0]; am.seek(0x04, 1)
+            NodeCount = struct.unpack('<L', am.read(4))[0]; am.seek(0x04, 1)
+            anim.groups[NodeAnimType] = [] # Create empty array to append to later on
+            NextGroupPos = am.tell()
+            # print("AnimType: " + AnimType(NodeAnimType).name + " | " + "NodeOffset: " + str(NodeOffset) + " | " + "NodeCount: " + str(NodeCount) + " | NextGroupPos: " + str(NextGroupPos))
+            am.seek(NodeOffset, 0)
+            for n in range(NodeCount):
+                NodeNameOffset = am.tell() + struct.unpack('<L', am.read(4))[0]; am.seek(0x04, 1)
+                NodeDataOffset = am.tell() + struct.unpack('<L', am.read(4))[0]; am.seek(0x04, 1)
+                at = AnimTrack()
+                # Special workaround for material tracks
+                if (NodeAnimType == AnimType.Material.value or NodeAnimType == AnimType.Camera.value):
+                    TrackCount = struct.unpack('<L', am.read(4))[0]; am.seek(0x04, 1)
+                    NextNodePos = am.tell()
+                    am.seek(NodeNameOffset, 0)
+                    NodeName = readVarLenString(am)
+                    am.seek(NodeDataOffset, 0)
+                    for tr in range(TrackCount):
+                        at = AnimTrack()
+                        at.name = NodeName
+                        # An offset for the type name, which will be seeked to later
+                        TypeOffset = am.tell() + struct.unpack('<L', am.read(4))[0]; am.seek(0x04, 1)
+                        at.flags = struct.unpack('<L', am.read(4))[0]
+                        at.frameCount = struct.unpack('<L', am.read(4))[0]
+                        Unk3_0 = struct.unpack('<L', am.read(4))[0]
+                        at.dataOffset = struct.unpack('<L', am.read(4))[0]
+                        at.dataSize = struct.unpack('<L', am.read(4))[0]; am.seek(0x04, 1)
+                        NextTrackPos = am.tell()
+                        am.seek(TypeOffset, 0)
+                        at.type = readVarLenString(am)
+                        am.seek(NextTrackPos, 0)
+                        anim.groups[NodeAnimType].append(at)
+                else:
+                    NextNodePos = am.tell() + struct.unpack('<L', am.read(4))[0] + 0x07
+
+                    am.seek(NodeNameOffset, 0)
+                    at.name = readVarLenString(am)
+                    am.seek(NodeDataOffset + 0x08, 0)
+                    at.flags = struct.unpack('<L', am.read(4))[0]
+                    at.frameCount = struct.unpack('<L', am.read(4))[0]
+                    Unk3_0 = struct.unpack('<L', am.read(4))[0]
+                    at.dataOffset = struct.unpack('<L', am.read(4))[0]
+                    at.dataSize = struct.unpack('<L', am.read(4))[0]; am.seek(0x04, 1)
+                    at.type = readVarLenString(am)
+                    anim.groups[NodeAnimType].append(at)
+
+                # print("NodeNameOffset: " + str(NodeNameOffset) + " | " + "NodeDataOffset: " + str(NodeDataOffset) + " | " + "NextNodePos: " + str(NextNodePos))
+                # print("NodeName: " + str(at.name) + " | " + "TrackFlags: " + str(at.flags) + " | " + "TrackFrameCount: " + str(at.frameCount) + " | " + "Unk3: " + str(Unk3_0) + " | " + "TrackDataOffset: " + str(at.dataOffset) +" | " + "TrackDataSize: " + str(at.dataSize))
+                am.seek(NextNodePos, 0)
+            # print("---------")
+            am.seek(NextGroupPos, 0)
+        return BufferOffset, BufferSize
+
+    else:
+        raise RuntimeError("%s is not a valid NUANMB file." % animPath)
+
+# Reads and decodes a single NUANMB file. The result holds everything needed to import it and no
+# Blender data is touched, so several files can be decoded at the same time
+def readAnimationFile(animPath, trackFilter=None, frameRange=None):
+    anim = AnimData()
+    anim.path = animPath
+    with open(animPath, 'rb') as am:
+        anim.bufferOffset, anim.bufferSize = readAnimationTables(am, anim, animPath)
+        if (trackFilter is not None):
+            filterTracks(anim.groups, trackFilter)
+        print(anim.groups)
+        am.seek(anim.bufferOffset, 0) # This must happen or all data will be read incorrectly
+        readAnimations(io.BytesIO(am.read(anim.bufferSize)), anim.groups, frameRange)
+
+    if (frameRange is not None):
+        anim.frameStart = min(frameRange[0], int(anim.frameCount))
+        anim.frameCount = min(frameRange[1], int(anim.frameCount)) - anim.frameStart
+    return anim
+
+# Identifies what gets decoded from a file: its contents, and the filter and frame range it's decoded with.
+# The filter is built from the armatures, meshes and materials being imported onto, so it stands in for them
+def getAnimationCacheKey(animPath, trackFilter, frameRange):
+    digest = hashlib.sha1()
+    with open(animPath, 'rb') as am:
+        digest.update(am.read())
+    if (trackFilter is not None):
+        trackFilter = sorted((animType, None if names is None else sorted(names)) for animType, names in trackFilter.items())
+    digest.update(repr((trackFilter, frameRange)).encode('utf-8'))
+    return digest.hexdigest()
+
+# Returns the decoded tracks of an animation as plain arrays, along with a description of the tracks that JSON can hold.
+# This is what gets cached, and what decoding processes send back, as the mathutils types can't be pickled
+def getAnimationArrays(anim):
+    meta = {"name": anim.name, "frameCount": anim.frameCount, "frameStart": anim.frameStart, "frameTotal": anim.frameTotal,
+            "bufferOffset": anim.bufferOffset, "bufferSize": anim.bufferSize, "groups": []}
+    arrays = {}
+    for animType, tracks in anim.groups.items():
+        for track in tracks:
+            if ((track.flags & 0x00ff) == AnimTrackFlags.Transform.value):
+                arrays["t%d" % len(arrays)] = getTransformArray(track)
+            else:
+                arrays["t%d" % len(arrays)] = numpy.asarray(track.animations)
+            meta["groups"].append([animType, track.name, track.type, track.flags, track.frameCount, track.dataOffset, track.dataSize])
+    return meta, arrays
+
+# Returns the animation that getAnimationArrays was given
+def getAnimationFromArrays(meta, arrays):
+    anim = AnimData()
+    anim.name = meta["name"]
+    anim.frameCount = meta["frameCount"]
+    anim.frameStart = meta["frameStart"]
+    anim.frameTotal = meta["frameTotal"]
+    anim.bufferOffset = meta["bufferOffset"]
+    anim.bufferSize = meta["bufferSize"]
+    for i, (animType, name, trackType, flags, frameCount, dataOffset, dataSize) in enumerate(meta["groups"]):
+        at = AnimTrack()
+        at.name, at.type, at.flags, at.frameCount, at.dataOffset, at.dataSize = name, trackType, flags, frameCount, dataOffset, dataSize
+        values = arrays["t%d" % i]
+        # Give the frames back the same types that decoding them does
+        if ((flags & 0x00ff) == AnimTrackFlags.Transform.value):
+            at.animations = [mathutils.Matrix(m) for m in values.tolist()]
+        elif ((flags & 0x00ff) in (AnimTrackFlags.Texture.value, AnimTrackFlags.Vector4.value)):
+            at.animations = [mathutils.Vector(v) for v in values.tolist()]
+        else:
+            at.animations = values.tolist()
+        anim.groups.setdefault(animType, []).append(at)
+    return anim
+
+# Stores the decoded tracks of an animation as plain arrays, along with a JSON description of the tracks
+def writeAnimationCache(cachePath, key, anim):
+    meta, arrays = getAnimationArrays(anim)
+    meta["key"] = key
+    with open(cachePath + ".tmp", 'wb') as cf:
+        numpy.savez(cf, meta=numpy.frombuffer(json.dumps(meta).encode('utf-8'), dtype=numpy.uint8), **arrays)
+    os.replace(cachePath + ".tmp", cachePath)
+
+# Returns the animation stored in a cache file, or None when the file was written for something else
+def readAnimationCache(cachePath, key):
+    with numpy.load(cachePath, allow_pickle=False) as cache:
+        meta = json.loads(cache["meta"].tobytes().decode('utf-8'))
+        if (meta["key"] != key):
+            return None
+        return getAnimationFromArrays(meta, cache)
+
+# Reads a NUANMB file through a cache next to it, so that importing the same file onto the same targets again skips decoding
+def readCachedAnimationFile(animPath, trackFilter=None, frameRange=None):
+    cachePath = animPath + ".cache.npz"
+    key = getAnimationCacheKey(animPath, trackFilter, frameRange)
+    if os.path.isfile(cachePath):
+        try:
+            anim = readAnimationCache(cachePath, key)
+            if (anim is not None):
+                print("Using cached decode of " + animPath)
+                anim.path = animPath
+                return anim
+        except (OSError, ValueError, KeyError) as e:
+            print("Ignoring unreadable cache " + cachePath + ": " + str(e))
+
+    anim = readAnimationFile(animPath, trackFilter, frameRange)
+    try:
+        writeAnimationCache(cachePath, key, anim)
+    except OSError as e:
+        print("Couldn't write cache " + cachePath + ": " + str(e))
+    return anim
+
+# Reads only the tables of a NUANMB file; its tracks get decoded chunk by chunk while it's being imported
+def openAnimationStream(animPath, chunkSize, trackFilter=None, frameRange=None):
+    anim = AnimStream(animPath, chunkSize)
+    with open(animPath, 'rb') as am:
+        anim.bufferOffset, anim.bufferSize = readAnimationTables(am, anim, animPath)
+    if (trackFilter is not None):
+        filterTracks(anim.groups, trackFilter)
+
+    anim.frameCount = int(anim.frameCount)
+    if (frameRange is not None):
+        anim.frameStart = min(frameRange[0], anim.frameCount)
+        anim.frameCount = min(frameRange[1], anim.frameCount) - anim.frameStart
+    return anim
+
+# Decodes a file in a process of the decoding pool, and returns it as plain arrays
+def decodeAnimationArrays(animPath, trackFilter, frameRange, use_cache):
+    readFile = readCachedAnimationFile if use_cache else readAnimationFile
+    return getAnimationArrays(readFile(animPath, trackFilter, frameRange))
+
+# Seconds to wait for a file from the decoding pool; one that takes longer is taken to be stuck, and the pool stopped
+ParallelTimeout = 300
+
+# Yields the decoded contents of every given file, in the same order as the files were given
+def decodeAnimationFiles(animPaths, parallel_decode, trackFilter=None, frameRange=None, chunkSize=0, use_cache=False):
+    readFile = readCachedAnimationFile if use_cache else readAnimationFile
+    if (chunkSize > 0):
+        # Streamed files are decoded while they're being imported, so there's nothing to decode ahead of time
+        for animPath in animPaths:
+            yield openAnimationStream(animPath, chunkSize, trackFilter, frameRange)
+        return
+
+    # Later files are decoded by a pool of processes while the caller imports the ones that are done; decoding is
+    # pure Python, so threads would only take turns. Only a few files are decoded ahead of time so that the results
+    # don't pile up in memory. As when exporting, processes are forked, which is only done on Linux. Without a pool,
+    # or when the pool fails or times out, the files it hasn't handed back are decoded here
+    workers = min(len(animPaths), os.cpu_count() or 1)
+    done = 0
+    if (parallel_decode and workers > 1 and
+            sys.platform.startswith("linux") and "fork" in multiprocessing.get_all_start_methods()):
+        pool = None
+        try:
+            pool = multiprocessing.get_context("fork").Pool(workers)
+            pending = collections.deque()
+            for i, animPath in enumerate(animPaths):
+                pending.append(pool.apply_async(decodeAnimationArrays, (animPath, trackFilter, frameRange, use_cache)))
+                while (len(pending) > workers * 2 or (pending and i == len(animPaths) - 1)):
+                    anim = getAnimationFromArrays(*pending.popleft().get(ParallelTimeout))
+                    anim.path = animPaths[done]
+                    done += 1
+                    yield anim
+        except (OSError, pickle.PicklingError, multiprocessing.TimeoutError) as e:
+            print("Decoding files one at a time: " + (str(e) or type(e).__name__))
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+
+    for animPath in animPaths[done:]:
+        yield readFile(animPath, trackFilter, frameRange)
+
+# Identifies armatures that an action can be shared between: the same bones, with the same parents and rest pose
+def getArmatureSignature(armature):
+    return tuple((bone.name, bone.parent.name if bone.parent else "", tuple(round(v, 4) for row in bone.matrix_local for v in row)) for bone in armature.data.bones)
+
+# Returns the armatures to import onto, grouped by their signature; every group only gets keyed once.
+# The group of the active armature always comes first
+def getArmatureGroups(context, use_selected_armatures):
+    armatures = [context.object]
+    if use_selected_armatures:
+        armatures += [o for o in context.selected_objects if (o.type == 'ARMATURE' and o != context.object)]
+    armatureGroups = {}
+    for armature in armatures:
+        armatureGroups.setdefault(getArmatureSignature(armature), []).append(armature)
+    return list(armatureGroups.values())
+
+# Gives an action that was imported onto one armature to another armature with the same signature,
+# along with the bone settings and custom properties that the action relies on
+def shareAction(source, target, action):
+    for bone in target.data.bones:
+        bone.inherit_scale = source.data.bones[bone.name].inherit_scale
+    for bone in target.pose.bones:
+        bone.matrix_basis.identity()
+        bone.rotation_mode = 'QUATERNION'
+
+    # Material tracks are keyed on custom properties, which have to exist for their fcurves to resolve
+    for fcurve in action.fcurves:
+        propName = fcurve.data_path[2:-2]
+        if (fcurve.data_path.startswith('["') and propName in source):
+            value = source[propName]
+            target[propName] = value.to_list() if hasattr(value, "to_list") else value
+
+    if (target.animation_data is None):
+        target.animation_data_create()
+    target.animation_data.action = action
+
+# Returns the action that the same file was imported as onto the same target before, emptied so that it can be
+# filled again in place, or a new action when there isn't one (or when refresh_actions is off)
+def getImportAction(name, sourcePath, target, refresh_actions):
+    sourcePath = os.path.abspath(sourcePath)
+    if refresh_actions:
+        for action in bpy.data.actions:
+            if (action.get("NUANMB Source") == sourcePath and action.get("NUANMB Target") == target.name):
+                # The fcurves themselves are kept, along with their modifiers and groups
+                for fcurve in action.fcurves:
+                    if hasattr(fcurve.keyframe_points, "clear"):
+                        fcurve.keyframe_points.clear()
+                    else:
+                        while (len(fcurve.keyframe_points) > 0):
+                            fcurve.keyframe_points.remove(fcurve.keyframe_points[-1], fast=True)
+                for marker in list(action.pose_markers):
+                    action.pose_markers.remove(marker)
+                return action
+
+    action = bpy.data.actions.new(name)
+    action["NUANMB Source"] = sourcePath
+    action["NUANMB Target"] = target.name
+    return action
+
+# Removes the fcurves of a refreshed action that didn't get any keyframes back
+def removeEmptyFCurves(action):
+    for fcurve in list(action.fcurves):
+        if (len(fcurve.keyframe_points) == 0):
+            action.fcurves.remove(fcurve)
+
+# Groups the fcurves of an action by the bone that they animate
+def getBoneFCurves(action):
+    boneFCurves = {}
+    for fcurve in action.fcurves:
+        if fcurve.data_path.startswith('pose.bones["'):
+            boneFCurves.setdefault(fcurve.data_path[12:fcurve.data_path.index('"]')], []).append(fcurve)
+    return boneFCurves
+
+# Bones whose pose changes what a bone exports as, besides the bone itself. A bone that doesn't inherit scale is
+# exported relative to its parent's scaled pose, so the scale of its parent, and of every bone that the parent
+# inherits scale from, counts too
+def getScaleParents(bone):
+    parents = []
+    if (bone.inherit_scale == 'NONE'):
+        parent = bone.parent
+        while (parent is not None):
+            parents.append(parent)
+            if (parent.inherit_scale != 'FULL'):
+                break
+            parent = parent.parent
+    return parents
+
+# A checksum of everything that decides what a bone exports as: the keyframes of the bone and of its scale parents,
+# its inheritance settings and rotation mode, and its rest pose and that of its parent. The exporter computes the
+# same checksum to find the bones that haven't been edited
+def getBoneChecksum(obj, boneName, boneFCurves):
+    digest = hashlib.sha1()
+    bone = obj.data.bones[boneName]
+    digest.update(("%s:%s:%d:%d" % (bone.inherit_scale, obj.pose.bones[boneName].rotation_mode, bone.use_inherit_rotation, bone.use_local_location)).encode('utf-8'))
+    digest.update(numpy.array(bone.matrix_local, dtype=numpy.float32).tobytes())
+    if bone.parent:
+        digest.update(numpy.array(bone.parent.matrix_local, dtype=numpy.float32).tobytes())
+    for name in [boneName] + [parent.name for parent in getScaleParents(bone)]:
+        for fcurve in sorted(boneFCurves.get(name, []), key=lambda fcurve: (fcurve.data_path, fcurve.array_index)):
+            digest.update(("%s[%d]" % (fcurve.data_path, fcurve.array_index)).encode('utf-8'))
+            for attribute, width, dtype in (("co", 2, numpy.float32), ("handle_left", 2, numpy.float32), ("handle_right", 2, numpy.float32), ("interpolation", 1, numpy.int32)):
+                values = numpy.zeros(len(fcurve.keyframe_points) * width, dtype=dtype)
+                fcurve.keyframe_points.foreach_get(attribute, values)
+                digest.update(values.tobytes())
+    return digest.hexdigest()
+
+# Keeps the encoded data of the given bones' tracks on the action they were imported as, along with the checksum of
+# each bone, so that the exporter can copy the tracks of bones that haven't been edited since as they are
+def storeRawTracks(obj, anim, action, trackNames):
+    # Tracks that were only partly decoded can't stand in for the whole animation
+    if (anim.frameStart != 0 or int(anim.frameCount) != anim.frameTotal):
+        if ("NUANMB Tracks" in action):
+            del action["NUANMB Tracks"]
+        return
+
+    boneFCurves = getBoneFCurves(action)
+    rawTracks = {}
+    with open(anim.path, 'rb') as am:
+        for track in anim.groups.get(AnimType.Transform.value, []):
+            if (track.name in trackNames and track.name in boneFCurves):
+                am.seek(anim.bufferOffset + track.dataOffset, 0)
+                rawTracks[track.name] = {"flags": track.flags, "frameCount": track.frameCount, "data": am.read(track.dataSize),
+                                         "checksum": getBoneChecksum(obj, track.name, boneFCurves)}
+    action["NUANMB Tracks"] = rawTracks
+
+# Moves an imported action onto the end of a single NLA track, so that every imported file is kept
+def pushActionToNLA(context, obj, action):
+    nlaTracks = obj.animation_data.nla_tracks
+    nlaTrack = nlaTracks.get("NUANMB")
+    if (nlaTrack is None):
+        nlaTrack = nlaTracks.new()
+        nlaTrack.name = "NUANMB"
+
+    # A refreshed action keeps the strip it already has
+    if any(strip.action == action for strip in nlaTrack.strips):
+        obj.animation_data.action = None
+        return
+
+    stripStart = context.scene.frame_start
+    if (len(nlaTrack.strips) > 0):
+        stripStart = int(nlaTrack.strips[-1].frame_end) + 1
+    strip = nlaTrack.strips.new(action.name, stripStart, action)
+    obj.animation_data.action = None
+    context.scene.frame_end = max(context.scene.frame_end, int(strip.frame_end))
+
+def getAnimationInfo(self, context, camera_selected, filepath, read_transform, read_material, read_visibility, read_camera, reduce_keyframes, reduce_tolerance, parallel_decode, use_nla_strips, skip_unmatched, use_frame_range, frame_range_start, frame_range_end, use_streaming, stream_chunk_size, nuhlpb_path, helper_bones, use_selected_armatures, use_live_playback, target_fps, use_cache, refresh_actions):
     print(self.files); print(filepath)
+    animPaths = []
     for animFile in self.files:
         animPath = os.path.join(os.path.dirname(filepath), animFile.name)
         if os.path.isfile(animPath):
-            with open(animPath, 'rb') as am:
-                am.seek(0x10, 0)
-                AnimCheck = struct.unpack('<L', am.read(4))[0]
-                if (AnimCheck == 0x414E494D):
-                    AnimVerA = struct.unpack('<H', am.read(2))[0]
-                    AnimVerB = struct.unpack('<H', am.read(2))[0]
-                    FinalFrameIndex = struct.unpack('<f', am.read(4))[0]
-                    FrameCount = FinalFrameIndex + 1
-                    print("Total # of frames: " + str(FrameCount))
-                    print("Final frame index: " + str(FinalFrameIndex))
-                    Unk1 = struct.unpack('<H', am.read(2))[0]
-                    Unk2 = struct.unpack('<H', am.read(2))[0]
-                    AnimNameOffset = am.tell() + struct.unpack('<L', am.read(4))[0]; am.seek(0x04, 1)
-                    GroupOffset = am.tell() + struct.unpack('<L', am.read(4))[0]; am.seek(0x04, 1)
-                    GroupCount = struct.unpack('<L', am.read(4))[0]; am.seek(0x04, 1)
-                    BufferOffset = am.tell() + struct.unpack('<L', am.read(4))[0]; am.seek(0x04, 1)
-                    BufferSize = struct.unpack('<L', am.read(4))[0]; am.seek(0x04, 1)
-                    print("GroupOffset: " + str(GroupOffset) + " | " + "GroupCount: " + str(GroupCount) + " | " + "BufferOffset: " + str(BufferOffset) + " | " + "BufferSize: " + str(BufferSize))
-                    am.seek(AnimNameOffset, 0)
-                    AnimName = readVarLenString(am); am.seek(0x04, 1)
-                    print("AnimName: " + AnimName)
-                    am.seek(GroupOffset, 0)
-                    # Collect information about the nodes
-                    for g in range(GroupCount):
-                        NodeAnimType = struct.unpack('<L', am.read(4))[0]; am.seek(0x04, 1)
-                        NodeOffset = am.tell() + struct.unpack('<L', am.read(4))[0]; am.seek(0x04, 1)
-                        NodeCount = struct.unpack('<L', am.read(4))[0]; am.seek(0x04, 1)
-                        AnimGroups[NodeAnimType] = [] # Create empty array to append to later on
-                        NextGroupPos = am.tell()
-                        # print("AnimType: " + AnimType(NodeAnimType).name + " | " + "NodeOffset: " + str(NodeOffset) + " | " + "NodeCount: " + str(NodeCount) + " | NextGroupPos: " + str(NextGroupPos))
-                        am.seek(NodeOffset, 0)
-                        for n in range(NodeCount):
-                            NodeNameOffset = am.tell() + struct.unpack('<L', am.read(4))[0]; am.seek(0x04, 1)
-                            NodeDataOffset = am.tell() + struct.unpack('<L', am.read(4))[0]; am.seek(0x04, 1)
-                            at = AnimTrack()
-                            # Special workaround for material tracks
-                            if (NodeAnimType == AnimType.Material.value or NodeAnimType == AnimType.Camera.value):
-                                TrackCount = struct.unpack('<L', am.read(4))[0]; am.seek(0x04, 1)
-                                NextNodePos = am.tell()
-                                am.seek(NodeNameOffset, 0)
-                                NodeName = readVarLenString(am)
-                                am.seek(NodeDataOffset, 0)
-                                for tr in range(TrackCount):
-                                    at = AnimTrack()
-                                    at.name = NodeName
-                                    # An offset for the type name, which will be seeked to later
-                                    TypeOffset = am.tell() + struct.unpack('<L', am.read(4))[0]; am.seek(0x04, 1)
-                                    at.flags = struct.unpack('<L', am.read(4))[0]
-                                    at.frameCount = struct.unpack('<L', am.read(4))[0]
-                                    Unk3_0 = struct.unpack('<L', am.read(4))[0]
-                                    at.dataOffset = struct.unpack('<L', am.read(4))[0]
-                                    at.dataSize = struct.unpack('<L', am.read(4))[0]; am.seek(0x04, 1)
-                                    NextTrackPos = am.tell()
-                                    am.seek(TypeOffset, 0)
-                                    at.type = readVarLenString(am)
-                                    am.seek(NextTrackPos, 0)
-                                    AnimGroups[NodeAnimType].append(at)
-                            else:
-                                NextNodePos = am.tell() + struct.unpack('<L', am.read(4))[0] + 0x07
-
-                                am.seek(NodeNameOffset, 0)
-                                at.name = readVarLenString(am)
-                                am.seek(NodeDataOffset + 0x08, 0)
-                                at.flags = struct.unpack('<L', am.read(4))[0]
-                                at.frameCount = struct.unpack('<L', am.read(4))[0]
-                                Unk3_0 = struct.unpack('<L', am.read(4))[0]
-                                at.dataOffset = struct.unpack('<L', am.read(4))[0]
-                                at.dataSize = struct.unpack('<L', am.read(4))[0]; am.seek(0x04, 1)
-                                at.type = readVarLenString(am)
-                                AnimGroups[NodeAnimType].append(at)
-
-                            # print("NodeNameOffset: " + str(NodeNameOffset) + " | " + "NodeDataOffset: " + str(NodeDataOffset) + " | " + "NextNodePos: " + str(NextNodePos))
-                            # print("NodeName: " + str(at.name) + " | " + "TrackFlags: " + str(at.flags) + " | " + "TrackFrameCount: " + str(at.frameCount) + " | " + "Unk3: " + str(Unk3_0) + " | " + "TrackDataOffset: " + str(at.dataOffset) +" | " + "TrackDataSize: " + str(at.dataSize))
-                            am.seek(NextNodePos, 0)
-                        # print("---------")
-                        am.seek(NextGroupPos, 0)
-                    print(AnimGroups)
-                    am.seek(BufferOffset, 0) # This must happen or all data will be read incorrectly
-                    readAnimations(io.BytesIO(am.read(BufferSize)))
-
-                    # Now get the data into Blender
-                    if (read_camera and camera_selected):
-                        importCamera(context)
-                    else:
-                        importAnimations(context, read_transform, read_material, read_visibility)
-
-                else:
-                    raise RuntimeError("%s is not a valid NUANMB file." % animPath)
-
-def readAnimations(ao):
-    for ag in AnimGroups.items():
+            animPaths.append(animPath)
+
+    activeObject = context.object
+    armatureGroups = [] if (read_camera and camera_selected) else getArmatureGroups(context, use_selected_armatures)
+    if (use_live_playback and not (read_camera and camera_selected)):
+        # Live playback only poses bones
+        read_transform, read_material, read_visibility = True, False, False
+    # Only the group and track tables are read from every file before this filter is applied
+    trackFilter = getTrackFilter(context, camera_selected, [armature for armatures in armatureGroups for armature in armatures], read_transform, read_material, read_visibility, read_camera, skip_unmatched)
+    frameRange = (frame_range_start, max(frame_range_start, frame_range_end)) if use_frame_range else None
+    chunkSize = stream_chunk_size if use_streaming else 0
+    helperBones, hlpbPath = getHelperBones(os.path.dirname(filepath), nuhlpb_path, helper_bones)
+    if (hlpbPath is None and not (read_camera and camera_selected)):
+        self.report({'INFO'}, "No NUHLPB file found; helper bones come from the Helper Bones table")
+    for anim in decodeAnimationFiles(animPaths, parallel_decode, trackFilter, frameRange, chunkSize, use_cache):
+        # The source animations run at 60 frames per second; live playback always uses every frame
+        if (target_fps < 60 and not (use_live_playback and not (read_camera and camera_selected))):
+            anim.frameStep = 60.0 / target_fps
+
+        # Now get the data into Blender
+        if (read_camera and camera_selected):
+            action = importCamera(context, anim, reduce_keyframes, reduce_tolerance, refresh_actions)
+            if use_nla_strips:
+                pushActionToNLA(context, bpy.context.object, action)
+            continue
+
+        if use_live_playback:
+            for armatures in armatureGroups:
+                for armature in armatures:
+                    storeLiveAnimation(context, armature, anim, helperBones)
+            continue
+
+        # Every file is decoded once; it's keyed once per group of armatures, and the others in the group share the action
+        for armatures in armatureGroups:
+            context.view_layer.objects.active = armatures[0]
+            action = importAnimations(context, armatures[0], anim, read_transform, read_material, read_visibility, reduce_keyframes, reduce_tolerance, helperBones, refresh_actions)
+            for armature in armatures[1:]:
+                shareAction(armatures[0], armature, action)
+            if use_nla_strips:
+                for armature in armatures:
+                    pushActionToNLA(context, armature, action)
+
+    context.view_layer.objects.active = activeObject
+
+# Size in bytes of a single frame of uncompressed data, for every track type that readDirectData() reads
+DirectEntrySizes = {
+    AnimTrackFlags.Transform.value: 44,
+    AnimTrackFlags.Texture.value: 20,
+    AnimTrackFlags.Float.value: 4,
+    AnimTrackFlags.PatternIndex.value: 4,
+    AnimTrackFlags.Boolean.value: 1,
+    AnimTrackFlags.Vector4.value: 16,
+}
+
+# Decodes every track; when a frame range is given, only frames [frameStart, frameEnd) are decoded,
+# and each track's frameCount becomes the number of frames that were actually decoded
+def readAnimations(ao, animGroups, frameRange=None):
+    for ag in animGroups.items():
         for track in ag[1]:
             ao.seek(track.dataOffset, 0)
+            frameStart, frameEnd = 0, track.frameCount
+            if (frameRange is not None):
+                frameStart, frameEnd = min(frameRange[0], track.frameCount), min(frameRange[1], track.frameCount)
             # Collect the actual data pertaining to every node
-            if ((track.flags & 0xff00) == AnimTrackFlags.Constant.value or (track.flags & 0xff00) == AnimTrackFlags.ConstTransform.value):
+            if isConstantTrack(track):
                 print("readAnimations: Const or Const Transform")
                 readDirectData(ao, track)
             if ((track.flags & 0xff00) == AnimTrackFlags.Direct.value):
                 print("readAnimations: Direct")
-                for t in range(track.frameCount):
+                ao.seek(track.dataOffset + frameStart * DirectEntrySizes.get(track.flags & 0x00ff, 0), 0)
+                for t in range(frameStart, frameEnd):
                     readDirectData(ao, track)
             if ((track.flags & 0xff00) == AnimTrackFlags.Compressed.value):
                 print("readAnimations: Compressed")
-                readCompressedData(ao, track)
+                readCompressedData(ao, track, frameStart, frameEnd)
+            if (frameRange is not None):
+                track.frameCount = len(track.animations)
             #print(track.name + " | " + AnimType(ag[0]).name)
             #for id, frame in enumerate(track.animations):
             #    print(id + 1)
@@ -272,13 +1029,14 @@ def readDirectData(aq, track):
         """
 
     if ((track.flags & 0x00ff) == AnimTrackFlags.Texture.value):
-        print("Direct texture data extraction not yet implemented")
+        # [Scale U, Scale V, Rotation, Translate U, Translate V]
+        track.animations.append(mathutils.Vector(struct.unpack('<5f', aq.read(20))))
 
     if ((track.flags & 0x00ff) == AnimTrackFlags.Float.value):
         track.animations.append(struct.unpack('<f', aq.read(4))[0])
 
     if ((track.flags & 0x00ff) == AnimTrackFlags.PatternIndex.value):
-        print("Direct pattern index data extraction not yet implemented")
+        track.animations.append(struct.unpack('<L', aq.read(4))[0])
 
     if ((track.flags & 0x00ff) == AnimTrackFlags.Boolean.value):
         bitValue = struct.unpack('<B', aq.read(1))[0]
@@ -289,7 +1047,56 @@ def readDirectData(aq, track):
         x = struct.unpack('<f', aq.read(4))[0]; y = struct.unpack('<f', aq.read(4))[0]; z = struct.unpack('<f', aq.read(4))[0]; w = struct.unpack('<f', aq.read(4))[0]
         track.animations.append(mathutils.Vector([x, y, z, w]))
 
-def readCompressedData(aq, track):
+# Reads the bitCount-wide values (stored with their least significant bit first) that start at each
+# of the given bit offsets, all at once; 'bits' holds one array element per bit of the stream
+def extractBits(bits, bitOffsets, bitCount):
+    indices = bitOffsets[:, numpy.newaxis] + numpy.arange(bitCount)
+    weights = numpy.left_shift(numpy.uint64(1), numpy.arange(bitCount, dtype=numpy.uint64))
+    return (bits[indices].astype(numpy.uint64) * weights).sum(axis=1)
+
+# Every compressed entry has the same size, so the stream of frames [frameStart, frameEnd) can be read
+# without going through any of the frames before it
+def readCompressedBits(aq, track, ach, frameStart, frameEnd):
+    firstBit = frameStart * ach.bitsPerEntry
+    byteStart = firstBit // 8
+    byteEnd = (frameEnd * ach.bitsPerEntry + 7) // 8
+    aq.seek(track.dataOffset + ach.compressedDataOffset + byteStart, 0)
+    bits = numpy.unpackbits(numpy.frombuffer(aq.read(byteEnd - byteStart), dtype=numpy.uint8), bitorder='little')
+    # Offset of every entry, relative to the first byte that was read
+    entryOffsets = firstBit - (byteStart * 8) + numpy.arange(frameEnd - frameStart, dtype=numpy.int64) * ach.bitsPerEntry
+    return bits, entryOffsets
+
+# Turns quantized values back into floats by interpolating between the item's start and end
+def decompressValues(item, values):
+    scale = float((1 << item.count) - 1)
+    mu = values.astype(numpy.float64) / scale
+    return (item.start * (1 - mu)) + (item.end * mu)
+
+# Reads the (start, end, bit count) compression item of every value in an entry
+def readCompressedItems(aq, itemCount):
+    acj = [] # Contains an array of AnimCompressedItem objects
+    for i in range(itemCount):
+        Start = struct.unpack('<f', aq.read(4))[0]
+        End = struct.unpack('<f', aq.read(4))[0]
+        Count = struct.unpack('<L', aq.read(4))[0]; aq.seek(0x04, 1)
+        acj.append(AnimCompressedItem(Start, End, Count))
+    return acj
+
+# Decodes entries made of one quantized float per item into an array of shape (frames, items);
+# items without any bits keep their default value for every frame
+def decodeCompressedValues(aq, track, ach, acj, defaults, frameStart, frameEnd):
+    values = numpy.empty((frameEnd - frameStart, len(acj)))
+    values[:] = defaults
+    bits, entryOffsets = readCompressedBits(aq, track, ach, frameStart, frameEnd)
+    bitOffset = 0 # Position of the current item inside of an entry
+    for itemIndex, item in enumerate(acj):
+        if (item.count == 0):
+            continue
+        values[:, itemIndex] = decompressValues(item, extractBits(bits, entryOffsets + bitOffset, item.count))
+        bitOffset += item.count
+    return values
+
+def readCompressedData(aq, track, frameStart=0, frameEnd=None):
     ach = AnimCompressedHeader()
     ach.unk_4 = struct.unpack('<H', aq.read(2))[0]
     ach.flags = struct.unpack('<H', aq.read(2))[0]
@@ -297,7 +1104,9 @@ def readCompressedData(aq, track):
     ach.bitsPerEntry = struct.unpack('<H', aq.read(2))[0]
     ach.compressedDataOffset = struct.unpack('<L', aq.read(4))[0]
     ach.frameCount = struct.unpack('<L', aq.read(4))[0]
-    bp = 0 # Workaround to allow the bitreader function to continue at wherever it left off
+    if (frameEnd is None or frameEnd > ach.frameCount):
+        frameEnd = ach.frameCount
+    frameStart = min(frameStart, frameEnd)
 
     if ((track.flags & 0x00ff) == AnimTrackFlags.Transform.value):
         acj = [] # Contains an array of AnimCompressedItem objects
@@ -317,140 +1126,94 @@ def readCompressedData(aq, track):
         # Position [X, Y, Z, W]
         px = struct.unpack('<f', aq.read(4))[0]; py = struct.unpack('<f', aq.read(4))[0]; pz = struct.unpack('<f', aq.read(4))[0]; pw = struct.unpack('<H', aq.read(2))[0]
 
-        aq.seek(track.dataOffset + ach.compressedDataOffset, 0)
-        for f in range(ach.frameCount):
-            transform = mathutils.Matrix([[px, py, pz, pw], [rx, ry, rz, rw], [sx, sy, sz, 1]])
-            """
-            Matrix composition:
-                    | X | Y | Z | W |
-            Position|PX |PY |PZ |PW | 0
-            Rotation|RX |RY |RZ |RW | 1
-            Scale   |SX |SY |SZ |SW | 2
-                      0   1   2   3
-            SW is used to represent absolute scale, being populated with '1' by default
-            """
-
-            for itemIndex in range(len(acj)):
-                # First check if this track should be parsed
-                # TODO: Don't hard code these flags.
-                if (not ((itemIndex == 0 and (ach.flags & 0x3) == 0x3) # isotropic scale
-                    or (itemIndex >= 0 and itemIndex <= 2 and (ach.flags & 0x3) == 0x1) # normal scale
-                    or (itemIndex > 2 and itemIndex <= 5 and (ach.flags & 0x4) > 0)
-                    or (itemIndex > 5 and itemIndex <= 8 and (ach.flags & 0x8) > 0))):
-                    continue
-
-                item = acj[itemIndex]
-                # Decompress
-                valueBitCount = item.count
-                if (valueBitCount == 0):
-                    continue
-
-                value, bp = readBits(aq, valueBitCount, bp)
-                scale = 0
-                for k in range(valueBitCount):
-                    scale = scale | (0x1 << k)
-
-                frameValue = lerp(item.start, item.end, 0, 1, value / float(scale))
-                if frameValue == float('NaN'):
-                    frameValue = 0
-
-                # The 'Transform' type frequently depends on flags
-                if ((ach.flags & 0x3) == 0x3):
-                    # Scale isotropic
-                    if (itemIndex == 0):
-                        transform[2][3] = frameValue
-
-                if ((ach.flags & 0x3) == 0x1):
-                    # Scale normal
-                    if (itemIndex == 0):
-                        transform[2][0] = frameValue
-                    elif (itemIndex == 1):
-                        transform[2][1] = frameValue
-                    elif (itemIndex == 2):
-                        transform[2][2] = frameValue
-
-                # Rotation and Position
-                if (itemIndex == 3):
-                    transform[1][0] = frameValue
-                elif (itemIndex == 4):
-                    transform[1][1] = frameValue
-                elif (itemIndex == 5):
-                    transform[1][2] = frameValue
-                elif (itemIndex == 6):
-                    transform[0][0] = frameValue
-                elif (itemIndex == 7):
-                    transform[0][1] = frameValue
-                elif (itemIndex == 8):
-                    transform[0][2] = frameValue
-
-            # Rotations have an extra bit at the end
-            if ((ach.flags & 0x4) > 0):
-                wBit, bp = readBits(aq, 1, bp)
-                wFlip = wBit == 1
-
-                # W is calculated
-                transform[1][3] = math.sqrt(abs(1 - (pow(transform[1][0], 2) + pow(transform[1][1], 2) + pow(transform[1][2], 2))))
-
-                if wFlip:
-                    transform[1][3] *= -1
-
-            track.animations.append(transform)
+        transforms = numpy.empty((frameEnd - frameStart, 3, 4))
+        transforms[:] = [[px, py, pz, pw], [rx, ry, rz, rw], [sx, sy, sz, 1]]
+        """
+        Matrix composition:
+                | X | Y | Z | W |
+        Position|PX |PY |PZ |PW | 0
+        Rotation|RX |RY |RZ |RW | 1
+        Scale   |SX |SY |SZ |SW | 2
+                  0   1   2   3
+        SW is used to represent absolute scale, being populated with '1' by default
+        """
+        # Where every item ends up in the matrix above
+        # TODO: Don't hard code these flags.
+        if ((ach.flags & 0x3) == 0x3):
+            itemTargets = {0: (2, 3)} # Scale isotropic
+        elif ((ach.flags & 0x3) == 0x1):
+            itemTargets = {0: (2, 0), 1: (2, 1), 2: (2, 2)} # Scale normal
+        else:
+            itemTargets = {}
+        if ((ach.flags & 0x4) > 0):
+            itemTargets.update({3: (1, 0), 4: (1, 1), 5: (1, 2)})
+        if ((ach.flags & 0x8) > 0):
+            itemTargets.update({6: (0, 0), 7: (0, 1), 8: (0, 2)})
+
+        bits, entryOffsets = readCompressedBits(aq, track, ach, frameStart, frameEnd)
+        bitOffset = 0 # Position of the current item inside of an entry
+        for itemIndex in range(len(acj)):
+            item = acj[itemIndex]
+            # Decompress
+            if (itemIndex not in itemTargets or item.count == 0):
+                continue
+            row, column = itemTargets[itemIndex]
+            transforms[:, row, column] = decompressValues(item, extractBits(bits, entryOffsets + bitOffset, item.count))
+            bitOffset += item.count
+
+        # Rotations have an extra bit at the end
+        if ((ach.flags & 0x4) > 0):
+            wFlip = extractBits(bits, entryOffsets + bitOffset, 1) == 1
+            # W is calculated
+            transforms[:, 1, 3] = numpy.sqrt(numpy.abs(1 - numpy.sum(transforms[:, 1, :3] ** 2, axis=1)))
+            transforms[wFlip, 1, 3] *= -1
+
+        for transform in transforms.tolist():
+            track.animations.append(mathutils.Matrix(transform))
 
     if ((track.flags & 0x00ff) == AnimTrackFlags.Texture.value):
-        print("Compressed texture data extraction not yet implemented")
+        # [Scale U, Scale V, Rotation, Translate U, Translate V]
+        acj = readCompressedItems(aq, 5)
+        aq.seek(track.dataOffset + ach.defaultDataOffset, 0)
+        defaults = struct.unpack('<5f', aq.read(20))
+        values = decodeCompressedValues(aq, track, ach, acj, defaults, frameStart, frameEnd)
+        track.animations.extend(mathutils.Vector(v) for v in values.tolist())
 
     if ((track.flags & 0x00ff) == AnimTrackFlags.Float.value):
-        print("Compressed float data extraction not yet implemented")
+        acj = readCompressedItems(aq, 1)
+        aq.seek(track.dataOffset + ach.defaultDataOffset, 0)
+        defaults = struct.unpack('<f', aq.read(4))
+        values = decodeCompressedValues(aq, track, ach, acj, defaults, frameStart, frameEnd)
+        track.animations.extend(values[:, 0].tolist())
 
     if ((track.flags & 0x00ff) == AnimTrackFlags.PatternIndex.value):
-        print("Compressed pattern index data extraction not yet implemented")
+        # Pattern indices are stored as an offset from the smallest index instead of being quantized
+        indexMin = struct.unpack('<L', aq.read(4))[0]
+        indexMax = struct.unpack('<L', aq.read(4))[0]
+        Count = struct.unpack('<L', aq.read(4))[0]; aq.seek(0x04, 1)
+        aq.seek(track.dataOffset + ach.defaultDataOffset, 0)
+        default = struct.unpack('<L', aq.read(4))[0]
+        if (Count == 0):
+            track.animations.extend([default] * (frameEnd - frameStart))
+        else:
+            bits, entryOffsets = readCompressedBits(aq, track, ach, frameStart, frameEnd)
+            indices = numpy.minimum(extractBits(bits, entryOffsets, Count) + indexMin, max(indexMin, indexMax))
+            track.animations.extend(indices.astype(numpy.int64).tolist())
 
     if ((track.flags & 0x00ff) == AnimTrackFlags.Boolean.value):
-        aq.seek(track.dataOffset + ach.compressedDataOffset, 0)
-        for t in range(ach.frameCount):
-            bitValue, bp = readBits(aq, ach.bitsPerEntry, bp)
-            track.animations.append(bitValue == 1)
+        bits, entryOffsets = readCompressedBits(aq, track, ach, frameStart, frameEnd)
+        track.animations.extend((extractBits(bits, entryOffsets, ach.bitsPerEntry) == 1).tolist())
 
     if ((track.flags & 0x00ff) == AnimTrackFlags.Vector4.value):
-        acj = [] # Contains an array of AnimCompressedItem objects
-        for i in range(4):
-            Start = struct.unpack('<f', aq.read(4))[0]
-            End = struct.unpack('<f', aq.read(4))[0]
-            Count = struct.unpack('<L', aq.read(4))[0]; aq.seek(0x04, 1)
-            aci = AnimCompressedItem(Start, End, Count)
-            acj.append(aci)
-        #print(acj)
-
+        # [X, Y, Z, W]; one vector per frame, the same as for direct tracks
+        acj = readCompressedItems(aq, 4)
         aq.seek(track.dataOffset + ach.defaultDataOffset, 0)
-        values = []
-        # Copy default values
-        for c in range(4):
-            values.append(struct.unpack('<f', aq.read(4))[0])
-
-        aq.seek(track.dataOffset + ach.compressedDataOffset, 0)
-        for f in range(ach.frameCount):
-            for itemIndex in range(len(acj)):
-                item = acj[itemIndex]
-                # Decompress
-                valueBitCount = item.count
-                if (valueBitCount == 0):
-                    continue
-
-                value, bp = readBits(aq, valueBitCount, bp)
-                scale = 0
-                for k in range(valueBitCount):
-                    scale = scale | (0x1 << k)
-
-                frameValue = lerp(item.start, item.end, 0, 1, value / float(scale))
-                if frameValue == float('NaN'):
-                    frameValue = 0
-
-                values[itemIndex] = frameValue
-
-            track.animations.append(values)
+        defaults = struct.unpack('<4f', aq.read(16))
+        values = decodeCompressedValues(aq, track, ach, acj, defaults, frameStart, frameEnd)
+        track.animations.extend(mathutils.Vector(v) for v in values.tolist())
 
 # This function deals with all of the Blender-camera-specific operations
-def importCamera(context):
+def importCamera(context, anim, reduce_keyframes, reduce_tolerance, refresh_actions):
     # Should only enter this function if the selected object was the camera.
     cam = bpy.context.object
 
@@ -460,72 +1223,13 @@ def importCamera(context):
     except:
         cam.animation_data_create()
 
-    action = bpy.data.actions.new(AnimName)
+    action = getImportAction(anim.name, anim.path, cam, refresh_actions)
     cam.animation_data.action = action
 
     # Matrix setup
     cam.matrix_basis.identity()
     cam.rotation_mode = "QUATERNION"
 
-    # Animation frames start at 1, the same as what Blender uses by default
-    context.scene.frame_start = 1
-    sm = action.pose_markers.new(AnimName + "-start")
-    sm.frame = context.scene.frame_start
-    context.scene.frame_end = int(FrameCount) + 1
-    em = action.pose_markers.new(AnimName + "-end")
-    em.frame = context.scene.frame_end
-
-    for ag in AnimGroups.items():
-        if (ag[0] == AnimType.Transform.value):
-            cam.name = ag[1][0].name
-            # Iterate by frame, and loop through tracks by name to set the transformation matrices
-            for frame in range(int(FrameCount)):
-                for track in ag[1]:
-                    print("Track frame # " + str(frame) + ", type " + AnimType.Transform.name)
-                    qr = mathutils.Quaternion(track.animations[frame][1].wxyz)
-                    pm = mathutils.Matrix.Translation(track.animations[frame][0][:3]) # Position matrix
-                    rm = mathutils.Matrix.Rotation(qr.angle, 4, qr.axis) # Rotation matrix
-                    sx = mathutils.Matrix.Scale(track.animations[frame][2][0], 4, (1, 0, 0)) # Scale matrix
-                    sy = mathutils.Matrix.Scale(track.animations[frame][2][1], 4, (0, 1, 0))
-                    sz = mathutils.Matrix.Scale(track.animations[frame][2][2], 4, (0, 0, 1))
-
-                    cam.matrix_local = mathutils.Matrix(pm @ rm @ sx @ sy @ sz)
-
-                    cam.keyframe_insert(data_path ='location',
-                                            frame = frame + 1,
-                                            group = AnimName)
-                    cam.keyframe_insert(data_path ='rotation_quaternion',
-                                            frame = frame + 1,
-                                            group = AnimName)
-                    cam.keyframe_insert(data_path ='scale',
-                                            frame = frame + 1,
-                                            group = AnimName)
-
-        elif (ag[0] == AnimType.Camera.value):
-            print("Storing Camera Flags and Data as custom data")
-            for track in ag[1]:
-                print ("Camera Track Type: " + str(track.type))
-                if(track.type == "FieldOfView"):
-                    blender_frame = 1
-                    # TODO: Blender doesn't allow keyframing FOV directly,
-                    # need to figure out conversion between smash FOV
-                    # and convert that to Sensor Width and Focal Length
-                    for anim_frame in track.animations:
-                        cam["FOV"] = anim_frame
-                        cam.keyframe_insert(data_path = '["FOV"]',
-                                            frame = blender_frame,
-                                            group = AnimName)
-                        blender_frame += 1
-
-    # Create an empty object and then parent this camera to it.
-    # That way, we can rotate the empty 90 to match the orientation from the .numdlb script
-    empty = bpy.data.objects.new("empty", None)
-    empty.name = "Cam-Rotation-Fixer"
-    bpy.context.collection.objects.link(empty)
-
-    empty.rotation_euler[0] = math.radians(90)
-    cam.parent = empty
-
     # Now change the camera object's camera data, such as FOV, Lens Type, etc...
     cam.data.type       = "PERSP"
     cam.data.angle      = math.radians(56.7)
@@ -540,20 +1244,110 @@ def importCamera(context):
     render.pixel_aspect_y = 1
     render.fps            = 60
 
-def keyframe_insert_locrotscale(obj, boneName, frame, groupName):
-    obj.keyframe_insert(data_path = 'pose.bones["%s"].%s' % (boneName, 'location'),
-                        frame = frame,
-                        group = groupName)
-    obj.keyframe_insert(data_path = 'pose.bones["%s"].%s' % (boneName, 'rotation_quaternion'),
-                        frame = frame,
-                        group = groupName)
-    obj.keyframe_insert(data_path = 'pose.bones["%s"].%s' % (boneName, 'scale'),
-                        frame = frame,
-                        group = groupName)
+    # The focal length lives on the camera data, so it gets its own action
+    if (cam.data.animation_data is None):
+        cam.data.animation_data_create()
+    lensAction = getImportAction(anim.name + "-lens", anim.path, cam.data, refresh_actions)
+    cam.data.animation_data.action = lensAction
+
+    # Animation frames start at 1, the same as what Blender uses by default
+    context.scene.frame_start = anim.frameStart + 1
+    sm = action.pose_markers.new(anim.name + "-start")
+    sm.frame = context.scene.frame_start
+    context.scene.frame_end = anim.frameStart + int(anim.frameCount) + 1
+    em = action.pose_markers.new(anim.name + "-end")
+    em.frame = context.scene.frame_end
+
+    # Structure of this list is: [last keyed quaternion as [W, X, Y, Z]]; kept across chunks
+    lastQuaternion = []
+
+    for chunkStart, animGroups in anim.chunks():
+        for ag in animGroups.items():
+            if (ag[0] == AnimType.Transform.value and len(ag[1]) > 0):
+                track = ag[1][0]
+                cam.name = track.name
+                if (track.frameCount == 0 or len(track.animations) == 0):
+                    continue
+                transforms = getTransformArray(track)
+                # Blender stores quaternions as [W, X, Y, Z]
+                rotations = transforms[:, 1, [3, 0, 1, 2]]
+                lengths = numpy.linalg.norm(rotations, axis=1)[:, numpy.newaxis]
+                rotations = numpy.divide(rotations, lengths, out=numpy.tile([1.0, 0.0, 0.0, 0.0], (len(rotations), 1)), where=lengths > 0)
+                # Keep the quaternion signs continuous, including across chunks, so they interpolate the short way
+                if (lastQuaternion and numpy.dot(lastQuaternion[0], rotations[0]) < 0):
+                    rotations[0] *= -1
+                rotations = fixQuaternionSigns(rotations)
+                lastQuaternion[:] = [rotations[-1].copy()]
+
+                frames = getKeyedFrames(track, reduce_keyframes, reduce_tolerance)
+                keyFrames = chunkStart + getFrameTimes(track)[frames] + 1
+                interpolation = getKeyInterpolation(reduce_keyframes)
+                for i in range(3):
+                    writeFCurveKeyframes(action, 'location', i, anim.name, keyFrames, transforms[frames, 0, i], interpolation)
+                for i in range(4):
+                    writeFCurveKeyframes(action, 'rotation_quaternion', i, anim.name, keyFrames, rotations[frames, i], interpolation)
+                for i in range(3):
+                    writeFCurveKeyframes(action, 'scale', i, anim.name, keyFrames, transforms[frames, 2, i], interpolation)
+
+            elif (ag[0] == AnimType.Camera.value):
+                for track in ag[1]:
+                    print ("Camera Track Type: " + str(track.type))
+                    if (track.type == "FieldOfView" and len(track.animations) > 0):
+                        fov = numpy.array([numpy.ravel(v)[0] for v in track.animations], dtype=numpy.float64)
+                        frames = getKeyedFrames(track, reduce_keyframes, reduce_tolerance)
+                        keyFrames = chunkStart + getFrameTimes(track)[frames] + 1
+                        # The raw FOV is kept as custom data, which is what gets exported
+                        cam["FOV"] = fov[0]
+                        writeFCurveKeyframes(action, '["FOV"]', 0, anim.name, keyFrames, fov[frames], getKeyInterpolation(reduce_keyframes))
+                        # Smash FOV is the vertical angle in radians; with a horizontal sensor fit,
+                        # the focal length is found from the horizontal angle for the render's aspect ratio
+                        aspect = (render.resolution_x * render.pixel_aspect_x) / (render.resolution_y * render.pixel_aspect_y)
+                        lens = cam.data.sensor_width / (2.0 * numpy.tan(fov[frames] / 2.0) * aspect)
+                        writeFCurveKeyframes(lensAction, 'lens', 0, anim.name, keyFrames, lens, getKeyInterpolation(reduce_keyframes))
+
+    removeEmptyFCurves(action)
+    removeEmptyFCurves(lensAction)
+
+    # Create an empty object and then parent this camera to it.
+    # That way, we can rotate the empty 90 to match the orientation from the .numdlb script
+    # A camera that is imported onto again already has one
+    if (cam.parent is None or not cam.parent.name.startswith("Cam-Rotation-Fixer")):
+        empty = bpy.data.objects.new("empty", None)
+        empty.name = "Cam-Rotation-Fixer"
+        bpy.context.collection.objects.link(empty)
+
+        empty.rotation_euler[0] = math.radians(90)
+        cam.parent = empty
+
+    return action
+
+# Keys helper bones for a chunk of frames in bulk. Their poses are worked out for every frame at once from the
+# decoded tracks, the same way as for live playback, and the keyframes are written straight into their fcurves
+def keyHelperBones(obj, action, group, tracks, helperTracks, helperBones, scaledNames, chunkStart, lastQuaternions, reduce_keyframes, reduce_tolerance):
+    helperDrivers = {track.name: helperBones[track.name] for track in helperTracks}
+    basis = getLiveBasis(obj, tracks + helperTracks, scaledNames, helperDrivers)
+    boneIndices = {pbone.name: i for i, pbone in enumerate(obj.pose.bones)}
+    interpolation = getKeyInterpolation(reduce_keyframes)
+    for track in helperTracks:
+        if (len(track.animations) == 0):
+            continue
+        channels = basis[:len(track.animations), boneIndices[track.name]].astype(numpy.float64)
+        # Keep the quaternion signs continuous, including across chunks, so they interpolate the short way
+        rotations = channels[:, 3:7]
+        lastQuaternion = lastQuaternions.get(track.name)
+        if (lastQuaternion is not None and numpy.dot(lastQuaternion, rotations[0]) < 0):
+            rotations[0] *= -1
+        rotations[:] = fixQuaternionSigns(rotations)
+        lastQuaternions[track.name] = rotations[-1].copy()
+
+        frames = getKeyedFrames(track, reduce_keyframes, reduce_tolerance)
+        keyFrames = chunkStart + getFrameTimes(track)[frames] + 1
+        for dataPath, start, count in (("location", 0, 3), ("rotation_quaternion", 3, 4), ("scale", 7, 3)):
+            for i in range(count):
+                writeFCurveKeyframes(action, 'pose.bones["%s"].%s' % (track.name, dataPath), i, group, keyFrames, channels[frames, start + i], interpolation)
 
 # This function deals with all of the Blender-specific operations
-def importAnimations(context, read_transform, read_material, read_visibility):
-    obj = bpy.context.object
+def importAnimations(context, obj, anim, read_transform, read_material, read_visibility, reduce_keyframes, reduce_tolerance, helperBones, refresh_actions):
     bpy.ops.object.mode_set(mode='POSE', toggle=False)
 
     # Re-Enable inheriting scale for bones. Will get turned off per-animation
@@ -571,137 +1365,403 @@ def importAnimations(context, read_transform, read_material, read_visibility):
     except:
         obj.animation_data_create()
 
-    action = bpy.data.actions.new(AnimName)
+    action = getImportAction(anim.name, anim.path, obj, refresh_actions)
     obj.animation_data.action = action
 
     # Animation frames start at 1, the same as what Blender uses by default
-    context.scene.frame_start = 1
-    sm = action.pose_markers.new(AnimName + "-start")
+    context.scene.frame_start = anim.frameStart + 1
+    sm = action.pose_markers.new(anim.name + "-start")
     sm.frame = context.scene.frame_start
-    context.scene.frame_end = int(FrameCount) + 1
-    em = action.pose_markers.new(AnimName + "-end")
+    context.scene.frame_end = anim.frameStart + int(anim.frameCount) + 1
+    em = action.pose_markers.new(anim.name + "-end")
     em.frame = context.scene.frame_end
 
-    for ag in AnimGroups.items():
-        if (read_transform and ag[0] == AnimType.Transform.value):
-            # Iterate by frame, and loop through tracks by name to set the transformation matrices
-            for frame in range(int(FrameCount) + 1):
-                # Structure of this dict is: {bone name, transformation matrix}; is cleared on every frame
-                tfmArray = {}
-                print("Track frame # " + str(frame) + ", type " + AnimType.Transform.name)
+    # Structure of this dict is: {bone name, last keyed quaternion}; kept across chunks
+    lastQuaternions = {}
+    # Names of the bones that got keyed from a track of the file, rather than as helper bones
+    keyedTrackNames = set()
+    # Structure of this dict is: {bone name, constant track}; kept across chunks
+    heldTracks = {}
+    # Structure of this dict is: {helper bone name, last keyed quaternion as [W, X, Y, Z]}; kept across chunks
+    lastHelperQuaternions = {}
+
+    # Bones that get scaled stop inheriting scale; they are all found before any frame of any chunk is set.
+    # Helper bones are scaled along with the bones that drive them
+    if read_transform:
+        scaledNames = anim.getScaledTrackNames()
+        trackNames = {track.name for track in anim.groups.get(AnimType.Transform.value, [])}
+        scaledNames.update(helperName for helperName, driverName in helperBones.items() if driverName in scaledNames and helperName not in trackNames)
+        for trackName in scaledNames:
+            bone = obj.data.bones.get(trackName)
+            if (bone is not None):
+                bone.inherit_scale = 'NONE'
+
+    for chunkStart, animGroups in anim.chunks():
+        for ag in animGroups.items():
+            if (read_transform and ag[0] == AnimType.Transform.value):
+                tracks = ag[1]
+                keyedTrackNames.update(track.name for track in tracks if track.name in obj.pose.bones)
+                # Constant tracks only come with the first chunk, but keep posing their bones in the ones after it
+                heldTracks.update((track.name, track) for track in tracks if isConstantTrack(track))
+                # Helper bones take the pose of the bone that drives them; they're keyed in bulk after the other bones
+                helperTracks = getHelperTracks(tracks, helperBones, obj)
+                if helperTracks:
+                    chunkTracks = list({**heldTracks, **{track.name: track for track in tracks}}.values())
+                    keyHelperBones(obj, action, anim.name, chunkTracks, helperTracks, helperBones, scaledNames, chunkStart, lastHelperQuaternions, reduce_keyframes, reduce_tolerance)
+                if reduce_keyframes:
+                    # Structure of this dict is: {bone name, set of frame indices to key}
+                    keyframes = {track.name: getTrackKeyframes(track, reduce_tolerance) for track in tracks}
+                # Every track of a chunk is sampled at the same positions, so the longest track has all of them
+                frameTimes = getFrameTimes(max(tracks, key=lambda track: len(track.animations))) if tracks else []
+                print("Keying %d transform tracks over %d frames, from frame %d" % (len(tracks), len(frameTimes), chunkStart + 1))
+                # The bones that get posed are the same on every frame of the chunk, in the armature's bone order
+                trackNames = {track.name for track in tracks}
+                posedBones = [tbone for tbone in obj.pose.bones if tbone.name in trackNames]
+                # Iterate by frame, and loop through tracks by name to set the transformation matrices
+                for frame in range(max([track.frameCount for track in tracks], default=0)):
+                    # Structure of this dict is: {bone name, transformation matrix}; is cleared on every frame
+                    tfmArray = {}
+                    for track in tracks:
+                        if (frame < track.frameCount):
+                            # Set up a matrix that can set position, rotation, and scale all at once
+                            qr = mathutils.Quaternion(track.animations[frame][1].wxyz)
+                            pm = mathutils.Matrix.Translation(track.animations[frame][0][:3]) # Position matrix
+                            rm = mathutils.Matrix.Rotation(qr.angle, 4, qr.axis) # Rotation matrix
+                            sx = mathutils.Matrix.Scale(track.animations[frame][2][0], 4, (1, 0, 0)) # Scale matrix
+                            sy = mathutils.Matrix.Scale(track.animations[frame][2][1], 4, (0, 1, 0))
+                            sz = mathutils.Matrix.Scale(track.animations[frame][2][2], 4, (0, 0, 1))
+
+                            transform = mathutils.Matrix(pm @ rm @ sx @ sy @ sz)
+                            tfmArray[track.name] = transform
+
+                    # Iterate through the bone order in selected armature, and transform each of them
+                    for tbone in posedBones:
+                        if (tbone.name in tfmArray):
+                            keyFrame = not reduce_keyframes or frame in keyframes[tbone.name]
+                            # print(tbone.name + " | Animation matrix: " + str(tfmArray[tbone.name].transposed()))
+                            if (tbone.parent):
+                                tbone.matrix = tbone.parent.matrix @ tfmArray[tbone.name]
+                            else:
+                                tbone.matrix = tfmArray[tbone.name]
+
+                            if not keyFrame:
+                                continue
+
+                            if reduce_keyframes:
+                                # Keep keyed quaternions in one hemisphere, or dropped frames would interpolate the long way around
+                                lastQuaternion = lastQuaternions.get(tbone.name)
+                                if (lastQuaternion is not None and lastQuaternion.dot(tbone.rotation_quaternion) < 0):
+                                    tbone.rotation_quaternion = -tbone.rotation_quaternion
+                                lastQuaternions[tbone.name] = tbone.rotation_quaternion.copy()
+
+                            # First, add the position keyframes
+                            try:
+                                obj.keyframe_insert(data_path='pose.bones["%s"].%s' %
+                                           (tbone.name, "location"),
+                                           frame=chunkStart + frameTimes[frame] + 1,
+                                           group=anim.name)
+                            except:
+                                continue
+
+                            # Next, add the rotation keyframes
+                            try:
+                                obj.keyframe_insert(data_path='pose.bones["%s"].%s' %
+                                           (tbone.name, "rotation_quaternion"),
+                                           frame=chunkStart + frameTimes[frame] + 1,
+                                           group=anim.name)
+                            except:
+                                continue
+
+                            # Last, add the scale keyframes
+                            try:
+                                obj.keyframe_insert(data_path='pose.bones["%s"].%s' %
+                                           (tbone.name, "scale"),
+                                           frame=chunkStart + frameTimes[frame] + 1,
+                                           group=anim.name)
+                            except:
+                                continue
+
+                if reduce_keyframes:
+                    # keyframe_insert() makes Bezier keys, which would overshoot between the kept frames
+                    for track in tracks:
+                        for dataPath, count in (("location", 3), ("rotation_quaternion", 4), ("scale", 3)):
+                            for i in range(count):
+                                fcurve = action.fcurves.find('pose.bones["%s"].%s' % (track.name, dataPath), index=i)
+                                if (fcurve is not None):
+                                    setKeyframeInterpolation(fcurve, KeyInterpolation.Linear)
+
+            elif (read_visibility and ag[0] == AnimType.Visibility.value):
                 for track in ag[1]:
-                    if (frame < track.frameCount):
-                        # Set up a matrix that can set position, rotation, and scale all at once
-                        print("Track Name = " + str(track.name) + " ")
-                        qr = mathutils.Quaternion(track.animations[frame][1].wxyz)
-                        pm = mathutils.Matrix.Translation(track.animations[frame][0][:3]) # Position matrix
-                        rm = mathutils.Matrix.Rotation(qr.angle, 4, qr.axis) # Rotation matrix
-                        sx = mathutils.Matrix.Scale(track.animations[frame][2][0], 4, (1, 0, 0)) # Scale matrix
-                        sy = mathutils.Matrix.Scale(track.animations[frame][2][1], 4, (0, 1, 0))
-                        sz = mathutils.Matrix.Scale(track.animations[frame][2][2], 4, (0, 0, 1))
-
-                        scalex = track.animations[frame][2][0]
-                        scaley = track.animations[frame][2][1]
-                        scalez = track.animations[frame][2][2]
-
-                        if ((scalex != 1) or (scaley != 1) or (scalez != 1)):
-                            for bone in obj.data.bones:
-                                if (bone.name == track.name):
-                                    bone.inherit_scale = 'NONE'
-
-                        transform = mathutils.Matrix(pm @ rm @ sx @ sy @ sz)
-                        tfmArray[track.name] = transform
-
-                # Iterate through the bone order in selected armature, and transform each of them
-                for tbone in obj.pose.bones:
-                    if (tbone.name in tfmArray):
-                        # print(tbone.name + " | Animation matrix: " + str(tfmArray[tbone.name].transposed()))
-                        if (tbone.parent):
-                            tbone.matrix = tbone.parent.matrix @ tfmArray[tbone.name]
-                            #Naive Helper Bone Fixes, will be replaced once they are better understood
-                            if tbone.name == 'ShoulderL':
-                                match = next((x for x in ['H_SholderL', 'H_ShoulderL'] if x in obj.pose.bones.keys()), False)
-                                if match: #FoundHelperBone
-                                    hb = obj.pose.bones[match]
-                                    hb.matrix = tbone.parent.matrix @ tfmArray[tbone.name]
-                                    keyframe_insert_locrotscale(obj, hb.name, frame + 1, AnimName)
-                            if tbone.name == 'ArmL':
-                                match = next((x for x in ['H_ElbowL'] if x in obj.pose.bones.keys()), False)
-                                if match: #FoundHelperBone
-                                    hb = obj.pose.bones[match]
-                                    hb.matrix = tbone.parent.matrix @ tfmArray[tbone.name]
-                                    keyframe_insert_locrotscale(obj, hb.name, frame + 1, AnimName)
-                            if tbone.name == 'ShoulderR':
-                                match = next((x for x in ['H_SholderR', 'H_ShoulderR'] if x in obj.pose.bones.keys()), False)
-                                if match: #FoundHelperBone
-                                    hb = obj.pose.bones[match]
-                                    hb.matrix = tbone.parent.matrix @ tfmArray[tbone.name]
-                                    keyframe_insert_locrotscale(obj, hb.name, frame + 1, AnimName)
-                            if tbone.name == 'ArmR':
-                                match = next((x for x in ['H_ElbowR'] if x in obj.pose.bones.keys()), False)
-                                if match: #FoundHelperBone
-                                    hb = obj.pose.bones[match]
-                                    hb.matrix = tbone.parent.matrix @ tfmArray[tbone.name]
-                                    keyframe_insert_locrotscale(obj, hb.name, frame + 1, AnimName)
-
-                        else:
-                            tbone.matrix = tfmArray[tbone.name]
-
-                        # First, add the position keyframes
-                        try:
-                            obj.keyframe_insert(data_path='pose.bones["%s"].%s' %
-                                       (tbone.name, "location"),
-                                       frame=frame + 1,
-                                       group=AnimName)
-                        except:
+                    if reduce_keyframes:
+                        visKeyframes = getTrackKeyframes(track, reduce_tolerance)
+                    frameTimes = getFrameTimes(track)
+                    print("Keying visibility of %s over %d frames" % (track.name, len(track.animations)))
+                    for vframe, trackData in enumerate(track.animations):
+                        if (reduce_keyframes and vframe not in visKeyframes):
                             continue
 
-                        # Next, add the rotation keyframes
-                        try:
-                            obj.keyframe_insert(data_path='pose.bones["%s"].%s' %
-                                       (tbone.name, "rotation_quaternion"),
-                                       frame=frame + 1,
-                                       group=AnimName)
-                        except:
-                            continue
+                        # All meshes are visible by default, so search the object list and hide objects whose visibility is False
+                        for target in bpy.data.objects:
+                            if (target.type == 'MESH' and track.name == getExactObjectName(target.name, track.name)):
+                                target.hide_render = not trackData
+                                target.hide_viewport = not trackData
+                                target.keyframe_insert(data_path="hide_viewport", frame=chunkStart + frameTimes[vframe] + 1, group=anim.name)
+                                target.keyframe_insert(data_path="hide_render", frame=chunkStart + frameTimes[vframe] + 1, group=anim.name)
 
-                        # Last, add the scale keyframes
-                        try:
-                            obj.keyframe_insert(data_path='pose.bones["%s"].%s' %
-                                       (tbone.name, "scale"),
-                                       frame=frame + 1,
-                                       group=AnimName)
-                        except:
-                            continue
+            elif (read_material and ag[0] == AnimType.Material.value):
+                for track in ag[1]:
+                    if (len(track.animations) == 0):
+                        continue
+                    propName = "%s:%s" % (track.name, track.type)
+                    # One column per channel of the property; scalars have a single channel
+                    values = numpy.array([numpy.ravel(afv) for afv in track.animations], dtype=numpy.float64)
+                    frames = getKeyedFrames(track, reduce_keyframes, reduce_tolerance)
+                    # The property has to exist, with the right type and length, for its fcurves to resolve
+                    obj[propName] = values[frames[-1]].tolist() if (values.shape[1] > 1) else track.animations[frames[-1]]
+                    # Booleans and pattern indices hold their value until the next keyframe
+                    if ((track.flags & 0x00ff) in (AnimTrackFlags.Boolean.value, AnimTrackFlags.PatternIndex.value)):
+                        interpolation = KeyInterpolation.Constant
+                    else:
+                        interpolation = getKeyInterpolation(reduce_keyframes)
+                    for i in range(values.shape[1]):
+                        writeFCurveKeyframes(action, '["%s"]' % propName, i, track.name, chunkStart + getFrameTimes(track)[frames] + 1, values[frames, i], interpolation)
 
-        elif (read_visibility and ag[0] == AnimType.Visibility.value):
-            for track in ag[1]:
-                for vframe, trackData in enumerate(track.animations):
-                    print("Track frame # " + str(vframe + 1) + ", type " + AnimType.Visibility.name + " for " + track.name)
-                    print("Value: " + str(trackData))
-
-                    # All meshes are visible by default, so search the object list and hide objects whose visibility is False
-                    for target in bpy.data.objects:
-                        if (target.type == 'MESH' and track.name == getExactObjectName(target.name, track.name)):
-                            target.hide_render = not trackData
-                            target.hide_viewport = not trackData
-                            target.keyframe_insert(data_path="hide_viewport", frame=vframe + 1, group=AnimName)
-                            target.keyframe_insert(data_path="hide_render", frame=vframe + 1, group=AnimName)
-
-        elif (read_material and ag[0] == AnimType.Material.value):
-            for track in ag[1]:
-                blender_frame = 1
-                for afv in track.animations: #'Animation Frame Value'
-                    obj["%s:%s" % (track.name, track.type)] = afv
-                    obj.keyframe_insert(data_path = '["%s:%s"]' % (track.name, track.type),
-                                        frame = blender_frame,
-                                        group = track.name)
-                    blender_frame += 1
+    removeEmptyFCurves(action)
+    storeRawTracks(obj, anim, action, keyedTrackNames)
 
     # Clear any unkeyed poses
     for bone in obj.pose.bones:
         bone.matrix_basis.identity()
 
+    return action
+
+# ==== Live playback ====
+# Instead of being baked into actions, decoded bone transforms can be kept on the armature as packed
+# float32 buffers and posed by a frame change handler. Structure of obj["NUANMB Live"] is:
+# {animation name: {"frameStart", "frameCount", "bones", "keyed", "scaled", "basis"}}, where "basis" holds
+# Location [X, Y, Z], Rotation [W, X, Y, Z] and Scale [X, Y, Z] for every frame and every pose bone
+
+# Turns quaternions (rows of [X, Y, Z, W]) into rotation matrices; zero quaternions become the identity
+def quaternionsToMatrices(q):
+    lengths = numpy.linalg.norm(q, axis=-1, keepdims=True)
+    q = numpy.where(lengths > 0, q / numpy.where(lengths > 0, lengths, 1), [0.0, 0.0, 0.0, 1.0])
+    x, y, z, w = q[..., 0], q[..., 1], q[..., 2], q[..., 3]
+    m = numpy.empty(q.shape[:-1] + (3, 3))
+    m[..., 0, 0] = 1 - 2 * (y * y + z * z); m[..., 0, 1] = 2 * (x * y - z * w); m[..., 0, 2] = 2 * (x * z + y * w)
+    m[..., 1, 0] = 2 * (x * y + z * w); m[..., 1, 1] = 1 - 2 * (x * x + z * z); m[..., 1, 2] = 2 * (y * z - x * w)
+    m[..., 2, 0] = 2 * (x * z - y * w); m[..., 2, 1] = 2 * (y * z + x * w); m[..., 2, 2] = 1 - 2 * (x * x + y * y)
+    return m
+
+# Turns rotation matrices into quaternions, as rows of [W, X, Y, Z]; mathutils does the conversion so that
+# half turns, where the diagonal alone doesn't give the signs, come out right
+def matricesToQuaternions(m):
+    return numpy.array([mathutils.Matrix(r).to_quaternion() for r in m.tolist()]).reshape(m.shape[:-2] + (4,))
+
+# Returns the local transform of every frame of a transform track as (frames, 4, 4) matrices, built the same
+# way as when keying; frames past the end of the track hold its last frame
+def getTrackMatrices(track, frameCount):
+    transforms = getTransformArray(track)
+    transforms = transforms[numpy.minimum(numpy.arange(frameCount), len(transforms) - 1)]
+    matrices = numpy.zeros((frameCount, 4, 4))
+    matrices[:, :3, :3] = quaternionsToMatrices(transforms[:, 1, :]) * transforms[:, 2, numpy.newaxis, :3]
+    matrices[:, :3, 3] = transforms[:, 0, :3]
+    matrices[:, 3, 3] = 1
+    return matrices
+
+# Orders bones so that parents are posed before their children, and the bones that drive helper bones before
+# the helpers. A helper driven by one of its own children keeps its driver's local transform instead
+def getPoseOrder(bones, helperDrivers):
+    order = []
+    posedNames = set()
+    pending = sorted(bones, key=lambda b: len(b.parent_recursive))
+    while pending:
+        waiting = []
+        for bone in pending:
+            if ((bone.parent and bone.parent.name not in posedNames) or
+                    (bone.name in helperDrivers and helperDrivers[bone.name] not in posedNames)):
+                waiting.append(bone)
+            else:
+                order.append(bone)
+                posedNames.add(bone.name)
+        if (len(waiting) == len(pending)):
+            # Nothing else can be posed after its driver
+            order.extend(waiting)
+            break
+        pending = waiting
+    return order
+
+# Works out the pose of every bone for every frame at once, the same way that importAnimations() poses them
+# (a bone's pose is its parent's pose times its track, and a helper bone's pose is that of its driver), and
+# returns the matching location, rotation and scale of every pose bone as an array of shape (frames, bones, 10)
+def getLiveBasis(obj, tracks, scaledNames, helperDrivers):
+    tracksByName = {track.name: track for track in tracks if len(track.animations) > 0}
+    frameCount = max([len(track.animations) for track in tracksByName.values()], default=0)
+    boneIndices = {pbone.name: i for i, pbone in enumerate(obj.pose.bones)}
+    basis = numpy.zeros((frameCount, len(boneIndices), 10), dtype=numpy.float32)
+    basis[:, :, 3] = 1 # Identity rotation
+    basis[:, :, 7:] = 1 # Unit scale
+
+    poses = {}
+    for bone in getPoseOrder(obj.data.bones, helperDrivers):
+        rest = numpy.array(bone.matrix_local)
+        if (bone.parent):
+            parentPose = poses[bone.parent.name]
+            restOffset = numpy.linalg.inv(numpy.array(bone.parent.matrix_local)) @ rest
+        else:
+            parentPose = numpy.identity(4)
+            restOffset = rest
+
+        track = tracksByName.get(bone.name)
+        if (track is None):
+            # Unanimated bones stay in their rest pose relative to their parent
+            poses[bone.name] = parentPose @ restOffset
+            continue
+
+        if (helperDrivers.get(bone.name) in poses):
+            # Helper bones take the pose of the bone that drives them
+            poses[bone.name] = poses[helperDrivers[bone.name]]
+            local = numpy.linalg.inv(parentPose) @ poses[bone.name]
+        else:
+            local = getTrackMatrices(track, frameCount)
+            poses[bone.name] = parentPose @ local
+        if (bone.name in scaledNames and bone.parent):
+            # Bones that don't inherit scale get their rotation and scale through their parent's unscaled pose,
+            # but their location still through its full pose, the same way that Blender poses them
+            parentSpace = numpy.array(parentPose, copy=True)
+            parentSpace[..., :3, :3] /= numpy.linalg.norm(parentSpace[..., :3, :3], axis=-2, keepdims=True)
+            local = numpy.linalg.inv(parentSpace @ restOffset) @ poses[bone.name]
+            local[..., :, 3] = (numpy.linalg.inv(parentPose @ restOffset) @ poses[bone.name][..., :, 3:])[..., 0]
+        else:
+            local = numpy.linalg.inv(restOffset) @ local
+
+        scales = numpy.linalg.norm(local[:, :3, :3], axis=1)
+        scales[numpy.linalg.det(local[:, :3, :3]) < 0] *= -1
+        rotations = local[:, :3, :3] / numpy.where(scales == 0, 1, scales)[:, numpy.newaxis, :]
+        i = boneIndices[bone.name]
+        basis[:, i, 0:3] = local[:, :3, 3]
+        basis[:, i, 3:7] = fixQuaternionSigns(matricesToQuaternions(rotations))
+        basis[:, i, 7:10] = scales
+    return basis
+
+# Keeps a decoded animation on the armature for live playback, instead of keying it into an action
+def storeLiveAnimation(context, obj, anim, helperBones):
+    # Streamed chunks are joined back together; constant tracks only have one frame, which they keep holding
+    tracksByName = {}
+    for chunkStart, animGroups in anim.chunks():
+        for track in animGroups.get(AnimType.Transform.value, []):
+            if (track.name not in tracksByName):
+                tracksByName[track.name] = copyTrackHeader(track)
+            tracksByName[track.name].animations.extend(track.animations)
+    tracks = list(tracksByName.values())
+    helperTracks = getHelperTracks(tracks, helperBones, obj)
+    helperDrivers = {track.name: helperBones[track.name] for track in helperTracks}
+    tracks = [track for track in tracks + helperTracks if track.name in obj.pose.bones]
+    keyedNames = {track.name for track in tracks if len(track.animations) > 0}
+    scaledNames = getScaledTrackNames(tracks)
+    basis = getLiveBasis(obj, tracks, scaledNames, helperDrivers)
+
+    if ("NUANMB Live" not in obj):
+        obj["NUANMB Live"] = {}
+    obj["NUANMB Live"][anim.name] = {
+        "frameStart": anim.frameStart,
+        "frameCount": len(basis),
+        "bones": "\n".join(obj.pose.bones.keys()),
+        "keyed": "\n".join(sorted(keyedNames)),
+        "scaled": "\n".join(sorted(scaledNames)),
+        "basis": basis.tobytes(),
+    }
+    liveBasisCache.pop((obj.as_pointer(), anim.name), None)
+    obj.nuanmb_live_motion = anim.name
+
+# Structure of this dict is: {(armature pointer, animation name): basis array}; saves unpacking the buffer on every frame
+liveBasisCache = {}
+
+def getLiveBasisArray(obj, name):
+    key = (obj.as_pointer(), name)
+    if (key not in liveBasisCache):
+        live = obj["NUANMB Live"][name]
+        boneNames = live["bones"].split("\n")
+        if (boneNames != obj.pose.bones.keys()):
+            # The armature has changed since the animation was stored
+            return None
+        liveBasisCache[key] = numpy.frombuffer(bytes(live["basis"]), dtype=numpy.float32).reshape(live["frameCount"], len(boneNames), 10)
+    return liveBasisCache[key]
+
+def poseLiveAnimation(scene, obj):
+    name = obj.nuanmb_live_motion
+    if ("NUANMB Live" not in obj or name not in obj["NUANMB Live"]):
+        return
+    basis = getLiveBasisArray(obj, name)
+    if (basis is None or len(basis) == 0):
+        return
+    # Animation frames start at 1, the same as what Blender uses by default
+    frame = min(max(scene.frame_current - obj["NUANMB Live"][name]["frameStart"] - 1, 0), len(basis) - 1)
+    obj.pose.bones.foreach_set("location", basis[frame, :, 0:3].ravel())
+    obj.pose.bones.foreach_set("rotation_quaternion", basis[frame, :, 3:7].ravel())
+    obj.pose.bones.foreach_set("scale", basis[frame, :, 7:10].ravel())
+    # foreach_set() doesn't tag anything for an update by itself
+    obj.update_tag()
+
+@bpy.app.handlers.persistent
+def livePlaybackHandler(scene, *args):
+    for obj in scene.objects:
+        if (obj.type == 'ARMATURE' and "NUANMB Live" in obj):
+            poseLiveAnimation(scene, obj)
+
+# Items for the live animation menu; kept here since Blender doesn't keep its own reference to them
+liveMotionItems = []
+
+def getLiveMotionItems(self, context):
+    liveMotionItems.clear()
+    if ("NUANMB Live" in self):
+        liveMotionItems.extend((name, name, "") for name in self["NUANMB Live"].keys())
+    return liveMotionItems
+
+# Switching to another live animation sets up the armature the same way importing it does
+def setLiveMotion(self, context):
+    live = self["NUANMB Live"][self.nuanmb_live_motion]
+    scaledNames = set(live["scaled"].split("\n"))
+    for bone in self.data.bones:
+        bone.inherit_scale = 'NONE' if bone.name in scaledNames else 'FULL'
+    for bone in self.pose.bones:
+        bone.rotation_mode = 'QUATERNION'
+    # An action would override the pose that the handler sets
+    if (self.animation_data is not None):
+        self.animation_data.action = None
+    context.scene.frame_start = live["frameStart"] + 1
+    context.scene.frame_end = live["frameStart"] + live["frameCount"]
+    poseLiveAnimation(context.scene, self)
+
+# Keys a live animation into an action, one bulk fcurve write per channel, and removes it from live playback
+def bakeLiveAnimation(context, obj, name):
+    live = obj["NUANMB Live"][name]
+    basis = getLiveBasisArray(obj, name)
+    if (basis is None):
+        raise RuntimeError("The bones of %s have changed since %s was imported." % (obj.name, name))
+    boneIndices = {pbone.name: i for i, pbone in enumerate(obj.pose.bones)}
+
+    if (obj.animation_data is None):
+        obj.animation_data_create()
+    action = bpy.data.actions.new(name)
+    sm = action.pose_markers.new(name + "-start")
+    sm.frame = live["frameStart"] + 1
+    em = action.pose_markers.new(name + "-end")
+    em.frame = live["frameStart"] + live["frameCount"]
+
+    frames = live["frameStart"] + numpy.arange(len(basis)) + 1
+    for boneName in live["keyed"].split("\n"):
+        if (boneName not in boneIndices):
+            continue
+        channels = basis[:, boneIndices[boneName]]
+        for dataPath, start, count in (("location", 0, 3), ("rotation_quaternion", 3, 4), ("scale", 7, 3)):
+            for i in range(count):
+                writeFCurveKeyframes(action, 'pose.bones["%s"].%s' % (boneName, dataPath), i, name, frames, channels[:, start + i])
+
+    del obj["NUANMB Live"][name]
+    liveBasisCache.pop((obj.as_pointer(), name), None)
+    obj.animation_data.action = action
+    return action
+
 # ==== Import OPERATOR ====
 from bpy_extras.io_utils import (ImportHelper)
 
@@ -739,6 +1799,116 @@ class NUANMB_Import_Operator(bpy.types.Operator, ImportHelper):
             default=True,
             )
 
+    skip_unmatched: bpy.props.BoolProperty(
+            name="Skip Unmatched Tracks",
+            description="Don't decode tracks whose name doesn't match a bone of the armature, a mesh, or a material",
+            default=False,
+            )
+
+    use_selected_armatures: bpy.props.BoolProperty(
+            name="All Selected Armatures",
+            description="Import onto every selected armature instead of only the active one. Armatures with the same bones and rest pose share one action",
+            default=False,
+            )
+
+    use_live_playback: bpy.props.BoolProperty(
+            name="Live Playback",
+            description="Keep the decoded bone transforms on the armature and pose it from them on every frame change, instead of keying an action. Animations can be baked to actions later",
+            default=False,
+            )
+
+    reduce_keyframes: bpy.props.BoolProperty(
+            name="Reduce Keyframes",
+            description="Skip keyframes that linear interpolation between the kept ones reproduces within the tolerance",
+            default=False,
+            )
+
+    reduce_tolerance: bpy.props.FloatProperty(
+            name="Tolerance",
+            description="Largest per-channel difference allowed between a skipped frame and its interpolated value",
+            default=0.0001,
+            min=0.0,
+            precision=5,
+            )
+
+    target_fps: bpy.props.IntProperty(
+            name="Frame Rate",
+            description="Keys per second of animation. The source animations run at 60, and lower rates resample them so that Blender interpolates in between",
+            default=60,
+            min=1,
+            max=60,
+            )
+
+    use_frame_range: bpy.props.BoolProperty(
+            name="Frame Range",
+            description="Only decode and import part of every animation",
+            default=False,
+            )
+
+    frame_range_start: bpy.props.IntProperty(
+            name="Start",
+            description="Index of the first frame to import, where 0 is the first frame of the file",
+            default=0,
+            min=0,
+            )
+
+    frame_range_end: bpy.props.IntProperty(
+            name="End",
+            description="Index of the frame after the last one to import",
+            default=60,
+            min=0,
+            )
+
+    nuhlpb_path: bpy.props.StringProperty(
+            name="NUHLPB File",
+            description="Helper bone file of the model. If left empty, model.nuhlpb is looked for next to the animations, then in the model folder that matches their motion folder",
+            default="",
+            subtype='FILE_PATH',
+            )
+
+    helper_bones: bpy.props.StringProperty(
+            name="Helper Bones",
+            description="Helper bones and the bones that drive them, as helper:driver pairs separated by commas. Only used when no NUHLPB file is found",
+            default="H_SholderL:ShoulderL, H_ShoulderL:ShoulderL, H_ElbowL:ArmL, H_SholderR:ShoulderR, H_ShoulderR:ShoulderR, H_ElbowR:ArmR",
+            )
+
+    use_streaming: bpy.props.BoolProperty(
+            name="Stream Frames",
+            description="Decode and import a chunk of frames at a time, so that memory use doesn't grow with the length of the animation",
+            default=False,
+            )
+
+    stream_chunk_size: bpy.props.IntProperty(
+            name="Chunk Size",
+            description="Number of frames decoded at a time when streaming",
+            default=256,
+            min=1,
+            )
+
+    parallel_decode: bpy.props.BoolProperty(
+            name="Parallel Decode",
+            description="Decode the next selected files in other processes while the current one is being imported (Linux only)",
+            default=False,
+            )
+
+    use_cache: bpy.props.BoolProperty(
+            name="Cache Decoded Files",
+            description="Keep the decoded animation next to every file, so that importing the same file onto the same targets again skips decoding",
+            default=False,
+            )
+
+    refresh_actions: bpy.props.BoolProperty(
+            name="Update Existing Actions",
+            description="Refill the action that a file was imported as before, instead of creating a new one",
+            default=True,
+            )
+
+    use_nla_strips: bpy.props.BoolProperty(
+            name="NLA Strips",
+            description="Place every imported action one after another on an NLA track, instead of only keeping the last one active",
+            default=False,
+            )
+
     def execute(self, context):
         keywords = self.as_keywords(ignore=("filter_glob", "files",))
         time_start = time.time()
@@ -787,10 +1957,140 @@ class NUANMB_PT_import_tracks(bpy.types.Panel):
         layout.prop(operator, "read_material")
         layout.prop(operator, "read_visibility")
         layout.prop(operator, "read_camera")
+        layout.prop(operator, "skip_unmatched")
+        layout.prop(operator, "use_selected_armatures")
+
+class NUANMB_PT_import_helpers(bpy.types.Panel):
+    bl_space_type = 'FILE_BROWSER'
+    bl_region_type = 'TOOL_PROPS'
+    bl_label = "Helper Bones"
+    bl_parent_id = "FILE_PT_operator"
+
+    @classmethod
+    def poll(cls, context):
+        sfile = context.space_data
+        operator = sfile.active_operator
+
+        return operator.bl_idname == "IMPORT_SCENE_OT_nuanmb"
+
+    def draw(self, context):
+        layout = self.layout
+        layout.use_property_split = True
+        layout.use_property_decorate = False  # No animation.
+
+        sfile = context.space_data
+        operator = sfile.active_operator
+
+        layout.prop(operator, "nuhlpb_path")
+        layout.prop(operator, "helper_bones")
+
+class NUANMB_PT_import_keyframes(bpy.types.Panel):
+    bl_space_type = 'FILE_BROWSER'
+    bl_region_type = 'TOOL_PROPS'
+    bl_label = "Keyframes"
+    bl_parent_id = "FILE_PT_operator"
+
+    @classmethod
+    def poll(cls, context):
+        sfile = context.space_data
+        operator = sfile.active_operator
+
+        return operator.bl_idname == "IMPORT_SCENE_OT_nuanmb"
+
+    def draw(self, context):
+        layout = self.layout
+        layout.use_property_split = True
+        layout.use_property_decorate = False  # No animation.
+
+        sfile = context.space_data
+        operator = sfile.active_operator
+
+        layout.prop(operator, "use_live_playback")
+        layout.prop(operator, "reduce_keyframes")
+        sub = layout.column()
+        sub.enabled = operator.reduce_keyframes
+        sub.prop(operator, "reduce_tolerance")
+        layout.prop(operator, "target_fps")
+
+        layout.prop(operator, "use_frame_range")
+        sub = layout.column(align=True)
+        sub.enabled = operator.use_frame_range
+        sub.prop(operator, "frame_range_start")
+        sub.prop(operator, "frame_range_end")
+
+class NUANMB_PT_import_files(bpy.types.Panel):
+    bl_space_type = 'FILE_BROWSER'
+    bl_region_type = 'TOOL_PROPS'
+    bl_label = "Multiple Files"
+    bl_parent_id = "FILE_PT_operator"
+
+    @classmethod
+    def poll(cls, context):
+        sfile = context.space_data
+        operator = sfile.active_operator
+
+        return operator.bl_idname == "IMPORT_SCENE_OT_nuanmb"
+
+    def draw(self, context):
+        layout = self.layout
+        layout.use_property_split = True
+        layout.use_property_decorate = False  # No animation.
+
+        sfile = context.space_data
+        operator = sfile.active_operator
+
+        layout.prop(operator, "parallel_decode")
+        layout.prop(operator, "use_streaming")
+        sub = layout.column()
+        sub.enabled = operator.use_streaming
+        sub.prop(operator, "stream_chunk_size")
+        layout.prop(operator, "use_cache")
+        layout.prop(operator, "refresh_actions")
+        layout.prop(operator, "use_nla_strips")
+
+class NUANMB_Bake_Live_Operator(bpy.types.Operator):
+    """Bakes the current live NUANMB animation into an action"""
+    bl_idname = ("anim.nuanmb_bake_live")
+    bl_label = ("Bake to Action")
+    bl_options = {'UNDO'}
+
+    def execute(self, context):
+        obj = context.object
+        bakeLiveAnimation(context, obj, obj.nuanmb_live_motion)
+        return {"FINISHED"}
+
+    @classmethod
+    def poll(self, context):
+        obj = context.active_object
+        return (obj is not None and obj.type == 'ARMATURE' and "NUANMB Live" in obj and obj.nuanmb_live_motion in obj["NUANMB Live"])
+
+class NUANMB_PT_live_playback(bpy.types.Panel):
+    bl_space_type = 'PROPERTIES'
+    bl_region_type = 'WINDOW'
+    bl_context = "object"
+    bl_label = "NUANMB Live Playback"
+
+    @classmethod
+    def poll(cls, context):
+        obj = context.object
+        return (obj is not None and obj.type == 'ARMATURE' and "NUANMB Live" in obj and len(obj["NUANMB Live"]) > 0)
+
+    def draw(self, context):
+        layout = self.layout
+        layout.use_property_split = True
+        layout.use_property_decorate = False  # No animation.
+
+        layout.prop(context.object, "nuanmb_live_motion")
+        layout.operator(NUANMB_Bake_Live_Operator.bl_idname)
 
 classes = (
     NUANMB_Import_Operator,
     NUANMB_PT_import_tracks,
+    NUANMB_PT_import_helpers,
+    NUANMB_PT_import_keyframes,
+    NUANMB_PT_import_files,
+    NUANMB_Bake_Live_Operator,
+    NUANMB_PT_live_playback,
 )
 
 # Add to a menu
@@ -801,10 +2101,19 @@ def register():
     for cls in classes:
         bpy.utils.register_class(cls)
 
+    bpy.types.Object.nuanmb_live_motion = bpy.props.EnumProperty(
+            name="Animation",
+            description="Animation that live playback poses this armature with",
+            items=getLiveMotionItems,
+            update=setLiveMotion,
+            )
+    bpy.app.handlers.frame_change_pre.append(livePlaybackHandler)
     bpy.types.TOPBAR_MT_file_import.append(menu_func_import)
 
 def unregister():
     bpy.types.TOPBAR_MT_file_import.remove(menu_func_import)
+    bpy.app.handlers.frame_change_pre.remove(livePlaybackHandler)
+    del bpy.types.Object.nuanmb_live_motion
 
     for cls in classes:
         bpy.utils.unregister_class(cls)
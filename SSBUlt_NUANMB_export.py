@@ -9,7 +9,7 @@ bl_info = {
     "location": "File > Export",
     "category": "Import-Export"}
 
-import bpy, enum, io, math, mathutils, os, struct, time, numpy
+import bpy, collections, enum, hashlib, io, json, math, multiprocessing, os, pickle, struct, sys, numpy
 
 class AnimType(enum.Enum):
     Transform = 1
@@ -29,59 +29,9 @@ class AnimTrackFlags(enum.Enum):
     Compressed = 1024
     Constant = 1280
 
-def write_c_string(f, s):
-    write_chars(f, s)
-    write_byte(f, 0) # Null terminator
-
 # Writes a variable number of empty bytes depending on necessary alignment
 def pad(f, alignment):
-    while(f.tell() % alignment):
-        write_byte(f, 0)
-
-def write_byte(f, val):
-    f.write(struct.pack('<B', val))
-
-def write_short(f, val):
-    f.write(struct.pack('<h', val))
-
-def write_ushort(f, val):
-    f.write(struct.pack('<H', val))
-
-def write_int(f, val):
-    f.write(struct.pack('<i', val))
-
-def write_uint(f, val):
-    f.write(struct.pack('<I', val))
-
-def write_float(f, val):
-    f.write(struct.pack('<f', val))
-
-def write_long64(f, val):
-    f.write(struct.pack('<q', val))
-
-def write_ulong64(f, val):
-    f.write(struct.pack('<Q', val))
-
-def write_chars(f, chars):
-    f.write(struct.pack('<{}s'.format(len(chars)), chars.encode()))
-
-def write_byte_array(f, ba):
-    f.write(ba.getbuffer())
-
-def write_bytes(f, bytes):
-    for byte in bytes:
-        write_byte(f, byte)
-
-# Some longs contain an offset to data, but that offset isn't the absolute file offset its
-# relative to that long's position in the file/buffer.
-def write_rel_offset(f, offsetPos):
-    # Backup file write pos
-    filePosBackup = f.tell()
-
-    f.seek(offsetPos) # Relative to file start
-    write_long64(f, filePosBackup - offsetPos) # Value written is the offset from the offsetPos to the data.
-
-    f.seek(filePosBackup)
+    f.write(bytes(-f.tell() % alignment))
 
 class Group:
     def __init__(self):
@@ -112,16 +62,18 @@ class NodeAnimTrack:
         self.dataSize = 0
         self.unk3 = 0
         self.animationTrack = [] # could be an array of matrix4x4, or vector4, or bools, or floats, or...
+        self.rawData = None # Encoded data copied as it is from the file the track was imported from
 
     def __repr__(self):
         return "Node name: " + str(self.name) + "\t| Type: " + str(self.type) + "\t| Flags: " + str(self.flags) + "\t| # of frames: " + str(self.frameCount) + "\t| Data offset: " + str(self.dataOffset) + "\t| Data size: " + str(self.dataSize) + "\n"
 
 class Quantanizer:
     def __init__(self, valueArray, epsilon):
+        valueArray = numpy.asarray(valueArray, dtype=numpy.float64)
         de_nan_array(valueArray)
         #self.values = valueArray
-        self.min = min(valueArray)
-        self.max = max(valueArray)
+        self.min = float(valueArray.min())
+        self.max = float(valueArray.max())
         if math.isclose(self.min, 1, rel_tol=1e-04):
             self.min = 1
         if math.isclose(self.max, 1, rel_tol=1e-04):
@@ -130,7 +82,7 @@ class Quantanizer:
             self.min = 0
         if math.isclose(self.max, 0, abs_tol=1e-04):
             self.max = 0
-        if math.isclose(self.min, self.max, rel_tol=1e-04):
+        if math.isclose(self.min, self.max, rel_tol=1e-04, abs_tol=epsilon):
             self.min = self.max
         self.constant = self.min == self.max
         self.bitCount = self.calc_bit_count(epsilon, valueArray)
@@ -141,255 +93,389 @@ class Quantanizer:
     def calc_bit_count(self, epsilon, valueArray):
         if self.constant:
             return 0
+        # The error of every bit count is worked out once, rather than again every time epsilon is raised
+        errors = [self.compute_error(bits, valueArray) for bits in range(1, 31)]
         while epsilon < 1:
-            for bits in range(1, 31):
-                if self.compute_error(bits, valueArray) < epsilon:
+            for bits, e in enumerate(errors, 1):
+                if e < epsilon:
                     return bits
             epsilon *= 2
         return -1 # Failed to find an optimal bit count. idk if this ever happens
 
     def compute_error(self, bits, valueArray):
-        e = 0
         if self.constant:
             return 0
-        for v in valueArray:
-            ce = abs(v - self.decompressed_value(v,bits))
-            e = max(e, ce)
-        return e
+        return float(numpy.max(numpy.abs(valueArray - self.decompressed_values(valueArray, bits))))
 
-    def decompressed_value(self, v, bits):
+    # Quantanizes a whole array of values at once; values are truncated to the step below them
+    def quantanize_values(self, values, bits):
+        qv = quantanization_value(bits)
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            quantanized = numpy.trunc((values - self.min) / (self.max - self.min) * qv)
+        quantanized[values <= self.min] = 0
+        quantanized[values >= self.max] = qv
+        return quantanized.astype(numpy.int64)
+
+    # What a whole array of values turns back into once quantanized and decompressed
+    def decompressed_values(self, values, bits):
         qv = quantanization_value(bits)
         if qv == 0:
-            return 0
+            return numpy.zeros_like(values)
 
-        return lerp(self.min, self.max, 0, 1, self.quantanize(v, bits) / quantanization_value(bits))
-
-    def quantanize(self, v, bits):
-        if v <= self.min:
-            return 0
-
-        if v >= self.max:
-            return quantanization_value(bits)
-
-        # Quantanized value, which is supposed to be an integer
-        quantanized = (v - self.min) / (self.max - self.min) * quantanization_value(bits)
-        quantanized = math.trunc(quantanized)
-        return quantanized
+        mu = self.quantanize_values(values, bits) / qv
+        decompressed = (self.min * (1 - mu)) + (self.max * mu)
+        decompressed[mu == 0] = self.min
+        decompressed[mu == 1] = self.max
+        return decompressed
 
 def quantanization_value(bitCount):
-    v = 0
-    for i in range(0, bitCount):
-        v |= 1 << i
-    return v
-
-# A standard linear interpolation function for individual values
-def lerp(av, bv, v0, v1, factor):
-    if (v0 == v1):
-        return av
-    if (factor == v0):
-        return av
-    if (factor == v1):
-        return bv
-
-    mu = (factor - v0) / (v1 - v0)
-    return (av * (1 - mu)) + (bv * mu)
+    return (1 << bitCount) - 1
 
+# Replaces the NaNs of an array with zeros, in place
 def de_nan_array(va):
-    for v in va:
-        if math.isnan(v):
-            print("NaN")
-            v = 0.0
-
-def material_group_hacks(f, g):
-    pad(f, 0x8) # 8-byte alignment for arrays
-    write_rel_offset(f, g.nodesOffsetPos)
+    nans = numpy.isnan(va)
+    if nans.any():
+        print("NaN")
+        va[nans] = 0.0
+
+# The file is laid out before any of it is written: every value is recorded along with where it goes, and once
+# the size of the whole file is known it's all packed into a single buffer, so nothing has to be seeked back to
+class Layout:
+    Long64 = struct.Struct('<q')
+
+    def __init__(self):
+        self.size = 0
+        self.records = [] # Structure of this list is: [(position, Struct or None for raw bytes, values)]
+
+    # Records values packed with a Struct, and returns where they go
+    def add(self, fmt, *values):
+        position = self.size
+        self.records.append((position, fmt, values))
+        self.size += fmt.size
+        return position
+
+    def add_bytes(self, data):
+        self.records.append((self.size, None, data))
+        self.size += len(data)
+
+    def add_c_string(self, s):
+        self.add_bytes(s.encode() + b'\0') # Null terminator
+
+    # Leaves room for a long that gets filled in later, and returns where it goes
+    def add_placeholder(self):
+        position = self.size
+        self.size += self.Long64.size
+        return position
+
+    # Writes a variable number of empty bytes depending on necessary alignment
+    def pad(self, alignment):
+        self.size += -self.size % alignment
+
+    # Some longs contain an offset to data, but that offset isn't the absolute file offset its
+    # relative to that long's position in the file/buffer.
+    def set_rel_offset(self, offsetPos):
+        self.records.append((offsetPos, self.Long64, (self.size - offsetPos,)))
+
+    def pack(self):
+        buffer = bytearray(self.size)
+        for position, fmt, values in self.records:
+            if fmt is None:
+                buffer[position:position + len(values)] = values
+            else:
+                fmt.pack_into(buffer, position, *values)
+        return buffer
+
+# Flags, frame count, unk3, data offset and data size of a track, after the offset to its type name
+TrackRecordStruct = struct.Struct('<IIIIq')
+# The start of the file: its tag and the size of the tag's header
+FileTagStruct = struct.Struct('<4si')
+# Everything of the header after its first 16 bytes, up to the offset to the anim name:
+# magic, version, final frame index, and 2 unknowns
+HeaderStruct = struct.Struct('<IHHfHH')
+
+def material_group_hacks(layout, g):
+    layout.pad(0x8) # 8-byte alignment for arrays
+    layout.set_rel_offset(g.nodesOffsetPos)
     for node in g.nodes:
-        node.nodeNameOffsetPos = f.tell()
-        write_long64(f, 0) # Placeholder offset, node name e.g. "EyeL"
-        node.nodeDataOffsetPos = f.tell()
-        write_long64(f, 0) # Placeholder offset, probably node data offset
-        write_long64(f, len(node.materialSubNodes)) #Material nodes have subnodes, e.g. CustomBoolean1. Length is 9 for "EyeL"
-        pad(f, 0x8)
+        node.nodeNameOffsetPos = layout.add_placeholder() # Placeholder offset, node name e.g. "EyeL"
+        node.nodeDataOffsetPos = layout.add_placeholder() # Placeholder offset, probably node data offset
+        layout.add(Layout.Long64, len(node.materialSubNodes)) #Material nodes have subnodes, e.g. CustomBoolean1. Length is 9 for "EyeL"
+        layout.pad(0x8)
 
     for node in g.nodes:
-        pad(f, 0x4) # 4-byte alignent for strings, about to write "EyeL"
-        write_rel_offset(f, node.nodeNameOffsetPos)
-        write_c_string(f, node.name)
-        pad(f, 0x8) # 8-byte alignment for arrays
-        write_rel_offset(f, node.nodeDataOffsetPos)
+        layout.pad(0x4) # 4-byte alignent for strings, about to write "EyeL"
+        layout.set_rel_offset(node.nodeNameOffsetPos)
+        layout.add_c_string(node.name)
+        layout.pad(0x8) # 8-byte alignment for arrays
+        layout.set_rel_offset(node.nodeDataOffsetPos)
 
         for msn in node.materialSubNodes:
             nat = msn.nodeAnimTrack
-            nat.typeOffsetPos = f.tell()
-            write_long64(f, 0) # A temp offset to the type name
-            write_uint(f, nat.flags)
-            write_uint(f, nat.frameCount)
-            write_uint(f, nat.unk3)
-            write_uint(f, nat.dataOffset)
-            write_long64(f, nat.dataSize)
-            pad(f, 0x8)
+            nat.typeOffsetPos = layout.add_placeholder() # A temp offset to the type name
+            layout.add(TrackRecordStruct, nat.flags, nat.frameCount, nat.unk3, nat.dataOffset, nat.dataSize)
+            layout.pad(0x8)
 
         for msn in node.materialSubNodes:
             nat = msn.nodeAnimTrack
-            pad(f, 0x4) # 4-byte alignement for strings, about to write "CustomVector0"
-            write_rel_offset(f, nat.typeOffsetPos)
-            write_c_string(f, nat.type)
+            layout.pad(0x4) # 4-byte alignement for strings, about to write "CustomVector0"
+            layout.set_rel_offset(nat.typeOffsetPos)
+            layout.add_c_string(nat.type)
             # ...Repeat for all custom vectors, looks like the type names are contiguous
 
     # Umm after this the massive unified animation data buffer gets written
     # What happened to the custom bools and floats?
     # Turns out studiosb doesnt write them out
 
-def write_group_array(f, groups):
+def write_group_array(layout, groups):
 
     # Write out some preliminary node stuff for all groups
     for g in groups:
-        write_long64(f, g.nodesAnimType) # Write the AnimType of the group, check out the enums
-        g.nodesOffsetPos = f.tell()
-        write_long64(f, 0) # Temp 'NodeOffset'
-        write_long64(f, len(g.nodes)) # NodeCount, a 'Node' could be something like a bone in an AnimTrack
-        pad(f, 0x8) # Probably not necessary since just wrote 3 long64s...
+        layout.add(Layout.Long64, g.nodesAnimType) # Write the AnimType of the group, check out the enums
+        g.nodesOffsetPos = layout.add_placeholder() # Temp 'NodeOffset'
+        layout.add(Layout.Long64, len(g.nodes)) # NodeCount, a 'Node' could be something like a bone in an AnimTrack
+        layout.pad(0x8) # Probably not necessary since just wrote 3 long64s...
 
     # Now actually write out the nodes
     for g in groups:
         if (g.nodesAnimType == AnimType.Material.value or g.nodesAnimType == AnimType.Camera.value):
-            material_group_hacks(f, g)
+            material_group_hacks(layout, g)
             continue
 
-        pad(f, 0x8) # 8-byte alignment for arrays
-        write_rel_offset(f, g.nodesOffsetPos)
+        layout.pad(0x8) # 8-byte alignment for arrays
+        layout.set_rel_offset(g.nodesOffsetPos)
 
         for node in g.nodes: # Node Prep
-            node.nodeNameOffsetPos = f.tell()
-            write_long64(f, 0) # Temp node name offset
-            node.nodeDataOffsetPos = f.tell()
-            write_long64(f, 0) # Temp node data offset
-            write_long64(f, 1) # 'Array.length', but it seems like only materials have multiple sub nodes in the array
-            pad(f, 0x8) # Probably not necessary, since only longs got written
+            node.nodeNameOffsetPos = layout.add_placeholder() # Temp node name offset
+            node.nodeDataOffsetPos = layout.add_placeholder() # Temp node data offset
+            layout.add(Layout.Long64, 1) # 'Array.length', but it seems like only materials have multiple sub nodes in the array
+            layout.pad(0x8) # Probably not necessary, since only longs got written
 
         for node in g.nodes: # Node Finalizer Loop
-            pad(f, 0x4) # 4-byte alignement for strings
-            write_rel_offset(f, node.nodeNameOffsetPos) # About to write name so go fill-in offset
-            write_c_string(f, node.name) # e.g "ArmL"
-            pad(f, 0x8) # 8-byte alignment for arrays
-            write_rel_offset(f, node.nodeDataOffsetPos) # Node data? like, the flags,framecount, AnimType, etc
+            layout.pad(0x4) # 4-byte alignement for strings
+            layout.set_rel_offset(node.nodeNameOffsetPos) # About to write name so go fill-in offset
+            layout.add_c_string(node.name) # e.g "ArmL"
+            layout.pad(0x8) # 8-byte alignment for arrays
+            layout.set_rel_offset(node.nodeDataOffsetPos) # Node data? like, the flags,framecount, AnimType, etc
             # Time to write out the node data, order is important
             nat = node.nodeAnimTrack
-            nat.typeOffsetPos = f.tell()
-            write_long64(f, 0) # A temp offset to the TypeName. Idk why its done this way rather than just write out the enum
-            write_uint(f, nat.flags)
-            write_uint(f, nat.frameCount)
-            write_uint(f, nat.unk3)
-            write_uint(f, nat.dataOffset) # Shouldn't this be unknown at this point? Already known in studiosb, which means the data buffer was already calculated at this point
-            write_long64(f, nat.dataSize) # guess I'll just premake the animation data buffer.
-                                          # dataOffset refers to its offset in the unified data buffer that contains all data for all nodes in all tracks.
-                                          # so, data offset will be 0 for the first entry
-            pad(f, 0x8)
-            pad(f, 0x4) # 4-byte alignement for strings
-            write_rel_offset(f, nat.typeOffsetPos)
-            write_c_string(f, nat.type)
+            nat.typeOffsetPos = layout.add_placeholder() # A temp offset to the TypeName. Idk why its done this way rather than just write out the enum
+            # dataOffset refers to its offset in the unified data buffer that contains all data for all nodes in all tracks,
+            # which has already been made, so data offset will be 0 for the first entry
+            layout.add(TrackRecordStruct, nat.flags, nat.frameCount, nat.unk3, nat.dataOffset, nat.dataSize)
+            layout.pad(0x8)
+            layout.pad(0x4) # 4-byte alignement for strings
+            layout.set_rel_offset(nat.typeOffsetPos)
+            layout.add_c_string(nat.type)
 
 def write_nuanmb(f, animBuffer, groups, finalFrameIndex, animName):
-    write_chars(f, "HBSS")
-    write_int(f, 0x40) # 4 bytes
-    pad(f, 0x10) # 16-Byte Aligned Header
-    write_uint(f, 0x414E494D) # Magic, 4 bytes
-    write_ushort(f, 0x0002) # VersionMajor, 2 bytes
-    write_ushort(f, 0x0000) # VersionMinor, 2 bytes
-    write_float(f, finalFrameIndex) # FFI, 4 bytes
-    write_ushort(f, 0x0001) # Unk1, 2 bytes
-    write_ushort(f, 0x0003) # Unk2, 2 bytes
-
-    animNameOffset = f.tell()
-    write_long64(f, 0) # Placeholder relative offset for anim name, 8 bytes
-
-    groupOffset = f.tell()
-    write_long64(f, 0) # Placeholder relative offset for animation arrays, aka the 'GroupOffset', 8 bytes
-
-    write_long64(f, len(groups)) # e.g '3' for anim w/ 'Transform', 'Visibility', 'Material' tracks, 8 bytes
-
-    bufferOffset = f.tell()
-    write_long64(f, 0) # Placeholder relative offset for GroupData "BufferOffset"
-
-    write_long64(f, animBuffer.getbuffer().nbytes) # "BufferSize"
-
-    pad(f, 0x8) # 8 bytes
-
-    pad(f, 0x4) # 4 bytes, necessary padding because file name string will be written
-    write_rel_offset(f, animNameOffset) #Nows a good time to fix the temp offset
-    write_c_string(f, animName) #variable bytes
-    pad(f, 0x4) # 4 bytes, apparently  strings are padded before and after?
-
-    pad(f, 0x8) # 8-byte alignement for arrays and matl data objects
-    write_rel_offset(f, groupOffset)
-    write_group_array(f, groups)
+    layout = Layout()
+    layout.add(FileTagStruct, b"HBSS", 0x40) # 4 bytes each
+    layout.pad(0x10) # 16-Byte Aligned Header
+    layout.add(HeaderStruct,
+        0x414E494D, # Magic, 4 bytes
+        0x0002, # VersionMajor, 2 bytes
+        0x0000, # VersionMinor, 2 bytes
+        finalFrameIndex, # FFI, 4 bytes
+        0x0001, # Unk1, 2 bytes
+        0x0003) # Unk2, 2 bytes
+
+    animNameOffset = layout.add_placeholder() # Placeholder relative offset for anim name, 8 bytes
+    groupOffset = layout.add_placeholder() # Placeholder relative offset for animation arrays, aka the 'GroupOffset', 8 bytes
+    layout.add(Layout.Long64, len(groups)) # e.g '3' for anim w/ 'Transform', 'Visibility', 'Material' tracks, 8 bytes
+    bufferOffset = layout.add_placeholder() # Placeholder relative offset for GroupData "BufferOffset"
+    layout.add(Layout.Long64, animBuffer.getbuffer().nbytes) # "BufferSize"
+
+    layout.pad(0x8) # 8 bytes
+
+    layout.pad(0x4) # 4 bytes, necessary padding because file name string will be written
+    layout.set_rel_offset(animNameOffset) #Nows a good time to fix the temp offset
+    layout.add_c_string(animName) #variable bytes
+    layout.pad(0x4) # 4 bytes, apparently  strings are padded before and after?
+
+    layout.pad(0x8) # 8-byte alignement for arrays and matl data objects
+    layout.set_rel_offset(groupOffset)
+    write_group_array(layout, groups)
 
     # Ready to write big buffer
-    pad(f, 0x8)
-    write_rel_offset(f, bufferOffset)
-    write_byte_array(f, animBuffer)
+    layout.pad(0x8)
+    layout.set_rel_offset(bufferOffset)
+    layout.add_bytes(animBuffer.getbuffer())
 
-def make_anim_buffer(context, groups, compression):
-    b = io.BytesIO()
+    f.write(layout.pack())
+
+def make_anim_buffer(context, groups, compression, cachePath=None):
+    nats = []
     for g in groups:
         for node in g.nodes:
             if node.materialSubNodes: #Material or Camera
-                for sn in node.materialSubNodes:
-                    write_track_from_nat(b, sn.nodeAnimTrack, compression)
+                nats += [sn.nodeAnimTrack for sn in node.materialSubNodes]
             else: #Normal
-                write_track_from_nat(b, node.nodeAnimTrack, compression)
+                nats.append(node.nodeAnimTrack)
+
+    if cachePath is not None and os.path.isfile(cachePath):
+        read_track_cache(cachePath)
+    keys = [get_track_key(nat, compression) if (nat.rawData is None and nat.animationTrack) else None for nat in nats]
+
+    # Every track is encoded on its own first, then they're put together in the order of the nodes
+    b = io.BytesIO()
+    for nat, (data, flags, frameCount) in zip(nats, encode_tracks(nats, compression, keys)):
+        nat.dataOffset = b.tell()
+        b.write(data)
+        nat.dataSize = len(data)
+        nat.flags = flags
+        nat.frameCount = frameCount
+        pad(b, 0x64)
+
+    if cachePath is not None:
+        write_track_cache(cachePath, keys)
     return b
 
+# Encodes a single track and returns (data, flags, frame count). Nothing but the track is used, so tracks can be
+# encoded in other processes
+def encode_track(nat, compression):
+    b = io.BytesIO()
+    write_track_from_nat(b, nat, compression)
+    return b.getvalue()[:nat.dataSize], nat.flags, nat.frameCount
+
+# Compressing fewer frames of transform tracks than this isn't worth starting other processes for
+ParallelFrameCount = 30000
+# Seconds to wait for the pool of processes; one that takes longer is taken to be stuck, and stopped
+ParallelTimeout = 300
+
+# Encodes every track and returns their (data, flags, frame count) in the same order. Transform tracks that get
+# compressed are spread over a pool of processes when there's enough of them. Processes are forked so that
+# they have this module without importing it again, which is only done on Linux: forking Blender elsewhere
+# can leave the children stuck on locks that its other threads held. Without a pool, or when the pool fails
+# or times out, every track is encoded here
+def encode_tracks(nats, compression, keys):
+    # Tracks that were encoded before, from the same frames, don't need to be encoded again
+    encoded = [get_encoded_track(key) if key is not None else None for key in keys]
+    parallel = [i for i, nat in enumerate(nats) if encoded[i] is None and
+                compression and nat.rawData is None and (nat.flags & 0x00ff) == AnimTrackFlags.Transform.value]
+    workers = min(len(parallel), os.cpu_count() or 1)
+    if (workers > 1 and sum(len(nats[i].animationTrack) for i in parallel) >= ParallelFrameCount and
+            sys.platform.startswith("linux") and "fork" in multiprocessing.get_all_start_methods()):
+        pool = None
+        try:
+            pool = multiprocessing.get_context("fork").Pool(workers)
+            results = pool.starmap_async(encode_track, [(nats[i], compression) for i in parallel],
+                                         chunksize=max(1, len(parallel) // (workers * 4))).get(ParallelTimeout)
+            for i, result in zip(parallel, results):
+                encoded[i] = result
+        except (OSError, pickle.PicklingError, multiprocessing.TimeoutError) as e:
+            print("Compressing tracks one at a time: " + (str(e) or type(e).__name__))
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+
+    for i, nat in enumerate(nats):
+        if encoded[i] is None:
+            encoded[i] = encode_track(nat, compression)
+        if keys[i] is not None:
+            store_encoded_track(keys[i], encoded[i])
+    return encoded
+
+# ==== Encoded track cache ====
+# Encoded tracks are kept for the rest of the session, keyed by the frames they were encoded from, so that
+# exporting again after a small edit only encodes the tracks that changed. They can also be kept in a file
+# next to the exported file, for exports in later sessions
+
+# Structure of this dict is: {track key, (data, flags, frame count)}; the least recently used are dropped first
+EncodedTracks = collections.OrderedDict()
+EncodedTrackLimit = 20000
+
+# Identifies what a track gets encoded from: its kind, its frames, and the compression settings
+def get_track_key(nat, compression):
+    digest = hashlib.sha1()
+    digest.update(repr((nat.flags, nat.type, len(nat.animationTrack), bool(compression), CompressionEpsilon)).encode('utf-8'))
+    digest.update(numpy.asarray(nat.animationTrack, dtype=numpy.float64).tobytes())
+    return digest.hexdigest()
+
+def get_encoded_track(key):
+    encoded = EncodedTracks.get(key)
+    if encoded is not None:
+        EncodedTracks.move_to_end(key)
+    return encoded
+
+def store_encoded_track(key, encoded):
+    EncodedTracks[key] = encoded
+    EncodedTracks.move_to_end(key)
+    while len(EncodedTracks) > EncodedTrackLimit:
+        EncodedTracks.popitem(last=False)
+
+# Adds the encoded tracks stored in a cache file to the ones of this session
+def read_track_cache(cachePath):
+    try:
+        with numpy.load(cachePath, allow_pickle=False) as cache:
+            meta = json.loads(cache["meta"].tobytes().decode('utf-8'))
+            for i, (key, flags, frameCount) in enumerate(meta):
+                store_encoded_track(key, (cache["t%d" % i].tobytes(), flags, frameCount))
+    except (OSError, ValueError, KeyError) as e:
+        print("Ignoring unreadable track cache " + cachePath + ": " + str(e))
+
+# Stores the encoded tracks of an export as plain arrays, along with a JSON list of their keys
+def write_track_cache(cachePath, keys):
+    meta = []
+    arrays = {}
+    for key in dict.fromkeys(key for key in keys if key in EncodedTracks):
+        data, flags, frameCount = EncodedTracks[key]
+        arrays["t%d" % len(meta)] = numpy.frombuffer(data, dtype=numpy.uint8)
+        meta.append([key, flags, frameCount])
+    try:
+        with open(cachePath + ".tmp", 'wb') as cf:
+            numpy.savez(cf, meta=numpy.frombuffer(json.dumps(meta).encode('utf-8'), dtype=numpy.uint8), **arrays)
+        os.replace(cachePath + ".tmp", cachePath)
+    except OSError as e:
+        print("Couldn't write track cache " + cachePath + ": " + str(e))
+
+# Writes transform frames as rows of 11 floats, all at once
+def write_transform_frames(b, frames):
+    '''
+    Smash matrix
+      0   1   2   3
+    0 SX  SY  SZ  N/A
+    1 RX  RY  RZ  RW
+    2 PX  PY  PZ  0
+    '''
+    at = numpy.asarray(frames, dtype=numpy.float64).reshape(-1, 12)
+    rows = numpy.zeros((len(at), 11))
+    rows[:, 0:3] = at[:, 0:3] # SX, SY, SZ
+    rows[:, 3:10] = at[:, 4:11] # RX, RY, RZ, RW, PX, PY, PZ
+    # The last float is always 0?
+    b.write(rows.astype('<f4').tobytes())
+
 def write_uncompressed_tranform(b, nat):
-    for af in nat.animationTrack: # af means "AnimationFrame"
-        '''
-        Smash matrix
-          0   1   2   3
-        0 SX  SY  SZ  N/A
-        1 RX  RY  RZ  RW
-        2 PX  PY  PZ  0
-        '''
-
-        sx = af[0][0]; sy = af[0][1]; sz = af[0][2]
-        rx = af[1][0]; ry = af[1][1]; rz = af[1][2]; rw = af[1][3]
-        px = af[2][0]; py = af[2][1]; pz = af[2][2]
-
-        write_float(b, sx); write_float(b, sy); write_float(b, sz)
-        write_float(b, rx); write_float(b, ry); write_float(b, rz); write_float(b, rw)
-        write_float(b, px); write_float(b, py); write_float(b, pz);
-        write_float(b, 0); # Always 0?
-
-        # Wrote Direct, so set Direct Flags
-        nat.flags |= AnimTrackFlags.Direct.value
+    write_transform_frames(b, nat.animationTrack)
 
-def all_same(nat):
-    allSame = True
-    first = nat.animationTrack[0]
-    for af in nat.animationTrack:
-        if first != af:
-            allSame = False
-            break
-    return allSame
+    # Wrote Direct, so set Direct Flags
+    nat.flags |= AnimTrackFlags.Direct.value
 
-def write_const_transform(b, nat):
-    af = nat.animationTrack[0]
+# Whether none of the channels of a transform track move: each has to stay within CompressionEpsilon of a single
+# value, the error compressing it would be allowed to make anyway. The bound doesn't grow with the values, so that
+# small motions of far away bones aren't taken for float noise
+def all_same(nat):
+    at = numpy.asarray(nat.animationTrack, dtype=numpy.float64).reshape(len(nat.animationTrack), 12)
+    return bool(numpy.all(at.max(axis=0) - at.min(axis=0) <= CompressionEpsilon))
 
-    sx = af[0][0]; sy = af[0][1]; sz = af[0][2]
-    rx = af[1][0]; ry = af[1][1]; rz = af[1][2]; rw = af[1][3]
-    px = af[2][0]; py = af[2][1]; pz = af[2][2]
+# Channels that stay within this of a single value don't move. It's also the largest error that compressing
+# a channel is allowed to make, to begin with
+CompressionEpsilon = 0.000002 # Maybe allow this to be set by user, but might just be confusing.
 
-    write_float(b, sx); write_float(b, sy); write_float(b, sz)
-    write_float(b, rx); write_float(b, ry); write_float(b, rz); write_float(b, rw)
-    write_float(b, px); write_float(b, py); write_float(b, pz);
-    write_float(b, 0); #Always 0?
+def write_const_transform(b, nat):
+    write_transform_frames(b, nat.animationTrack[:1])
 
     nat.flags |= AnimTrackFlags.ConstTransform.value
 
+# The header of a compressed transform track: its flags, bits per frame and frame count, then the range and bit
+# count of the 9 channels, and last the default values
+CompressedHeaderStruct = struct.Struct('<hhhHii' + 'ffq' * 9 + 'f' * 10 + 'i')
+
 def write_compressed_transform(b, nat):
 
     nat.flags |= AnimTrackFlags.Compressed.value
 
-    epsilon = 0.000002 # Maybe allow this to be set by user, but might just be confusing.
+    epsilon = CompressionEpsilon
 
     # Make the 'Animation Track' into a numpy array for vertical slicing
     at = numpy.array(nat.animationTrack)
@@ -450,114 +536,53 @@ def write_compressed_transform(b, nat):
         bitsPerEntry += pz.bitCount if not pz.constant else 0
 
     # Compressed Header
-    write_short(b, 0x04)
-    write_short(b, cFlags)
-    write_short(b, 160) # Not Hex in StudioSB
-    write_ushort(b, bitsPerEntry)
-    write_int(b, 204) # Not Hex in StudioSB
-    write_int(b, len(nat.animationTrack))
-    write_float(b, sx.min)
-    write_float(b, sx.max)
-    write_long64(b, sx.bitCount if hasScale else 16)
-    write_float(b, sy.min)
-    write_float(b, sy.max)
-    write_long64(b, sy.bitCount if hasScale else 16)
-    write_float(b, sz.min)
-    write_float(b, sz.max)
-    write_long64(b, sz.bitCount if hasScale else 16)
-    write_float(b, rx.min)
-    write_float(b, rx.max)
-    write_long64(b, rx.bitCount if hasRotation else 16)
-    write_float(b, ry.min)
-    write_float(b, ry.max)
-    write_long64(b, ry.bitCount if hasRotation else 16)
-    write_float(b, rz.min)
-    write_float(b, rz.max)
-    write_long64(b, rz.bitCount if hasRotation else 16)
-    write_float(b, px.min)
-    write_float(b, px.max)
-    write_long64(b, px.bitCount if hasPosition else 16)
-    write_float(b, py.min)
-    write_float(b, py.max)
-    write_long64(b, py.bitCount if hasPosition else 16)
-    write_float(b, pz.min)
-    write_float(b, pz.max)
-    write_long64(b, pz.bitCount if hasPosition else 16)
     dv = nat.animationTrack[0] #Default Values
-    write_float(b, dv[0][0])
-    write_float(b, dv[0][1])
-    write_float(b, dv[0][2])
-    write_float(b, dv[1][0])
-    write_float(b, dv[1][1])
-    write_float(b, dv[1][2])
-    write_float(b, dv[1][3])
-    write_float(b, dv[2][0])
-    write_float(b, dv[2][1])
-    write_float(b, dv[2][2])
-    write_int(b, 0)
-
-    # Now we can finally write the bits
-    bitString = ""
-    frame = 0
-    for af in nat.animationTrack:
-        if hasScale:
-            #print("Frame: " + str(frame) + " af[0][0] = " + str(af[0][0]))
-           # print("sx.quantanize = " + str(sx.quantanize(af[0][0], sx.bitCount)) + " ")
-            bitString += get_bits(sx.quantanize(af[0][0], sx.bitCount), sx.bitCount)
-            bitString += get_bits(sy.quantanize(af[0][1], sy.bitCount), sy.bitCount)
-            bitString += get_bits(sz.quantanize(af[0][2], sz.bitCount), sz.bitCount)
-
-        if hasRotation:
-            #print("Frame: " + str(frame) + " af[1][0] = " + str(af[1][0]))
-            #print("rx.quantanize = " + str(rx.quantanize(af[1][0], rx.bitCount)) + " ")
-            bitString += get_bits(rx.quantanize(af[1][0], rx.bitCount), rx.bitCount)
-            bitString += get_bits(ry.quantanize(af[1][1], ry.bitCount), ry.bitCount)
-            bitString += get_bits(rz.quantanize(af[1][2], rz.bitCount), rz.bitCount)
-
-        if hasPosition:
-            bitString += get_bits(px.quantanize(af[2][0], px.bitCount), px.bitCount)
-            bitString += get_bits(py.quantanize(af[2][1], py.bitCount), py.bitCount)
-            bitString += get_bits(pz.quantanize(af[2][2], pz.bitCount), pz.bitCount)
-            if not pz.constant:
-                print("Frame: " + str(frame) + ", af[2][2] = " + str(af[2][2]) + ", pz.quantize = " + str(pz.quantanize(af[2][2], pz.bitCount))
-                    + ",pz.bitCount =" + str(pz.bitCount) + ", bits = " + str(get_bits(pz.quantanize(af[2][2], pz.bitCount), pz.bitCount)))
-        if hasRotation:
-            # 'flip-W' bit
-            w = math.sqrt(math.fabs( 1 - (
-                rx.decompressed_value(af[1][0], rx.bitCount)**2 +
-                ry.decompressed_value(af[1][1], ry.bitCount)**2 +
-                rz.decompressed_value(af[1][2], rz.bitCount)**2)))
-            fBit = 1 if (af[1][3] < 0) != (w < 0) else 0
-            bitString += get_bits(fBit, 1)
-        frame += 1
-
-    #print("bitString Length = " + str(len(bitString)))
-    #print("bitString = " + str(bitString))
-    if bitString != "":
-        ba = get_bytes(bitString)
-        write_bytes(b, ba)
-
-def get_bits(value, bitCount):
-    bits = ""
-    for i in range(bitCount):
-        bit = (value >> i) & 0x1
-        bits += format(bit, 'b')
-    return bits
-
-def get_bytes(bitString):
-    ba = []
-    byte = 0
-    bitCounter = 0
-    for bit in bitString:
-        byte |= int(bit, 2) << bitCounter
-        bitCounter += 1
-        if bitCounter == 8:
-            ba.append(byte)
-            byte = 0
-            bitCounter = 0
-    if bitCounter != 0:
-        ba.append(byte)
-    return ba
+    b.write(CompressedHeaderStruct.pack(0x04, cFlags,
+        160, # Not Hex in StudioSB
+        bitsPerEntry,
+        204, # Not Hex in StudioSB
+        len(nat.animationTrack),
+        sx.min, sx.max, sx.bitCount if hasScale else 16,
+        sy.min, sy.max, sy.bitCount if hasScale else 16,
+        sz.min, sz.max, sz.bitCount if hasScale else 16,
+        rx.min, rx.max, rx.bitCount if hasRotation else 16,
+        ry.min, ry.max, ry.bitCount if hasRotation else 16,
+        rz.min, rz.max, rz.bitCount if hasRotation else 16,
+        px.min, px.max, px.bitCount if hasPosition else 16,
+        py.min, py.max, py.bitCount if hasPosition else 16,
+        pz.min, pz.max, pz.bitCount if hasPosition else 16,
+        dv[0][0], dv[0][1], dv[0][2],
+        dv[1][0], dv[1][1], dv[1][2], dv[1][3],
+        dv[2][0], dv[2][1], dv[2][2],
+        0))
+
+    # Now we can finally write the bits. Every frame is a row of bitsPerEntry bits, with the bits of each
+    # value going from least to most significant
+    columns = []
+    if hasScale:
+        columns += [(sx, at[:, 0, 0]), (sy, at[:, 0, 1]), (sz, at[:, 0, 2])]
+    if hasRotation:
+        columns += [(rx, at[:, 1, 0]), (ry, at[:, 1, 1]), (rz, at[:, 1, 2])]
+    if hasPosition:
+        columns += [(px, at[:, 2, 0]), (py, at[:, 2, 1]), (pz, at[:, 2, 2])]
+    bits = [get_bits(q.quantanize_values(values, q.bitCount), q.bitCount) for q, values in columns]
+
+    if hasRotation:
+        # 'flip-W' bit
+        w = numpy.sqrt(numpy.fabs( 1 - (
+            rx.decompressed_values(at[:, 1, 0], rx.bitCount)**2 +
+            ry.decompressed_values(at[:, 1, 1], ry.bitCount)**2 +
+            rz.decompressed_values(at[:, 1, 2], rz.bitCount)**2)))
+        fBits = ((at[:, 1, 3] < 0) != (w < 0)).astype(numpy.int64)
+        bits.append(get_bits(fBits, 1))
+
+    bitMatrix = numpy.concatenate(bits, axis=1) if bits else numpy.zeros((len(at), 0), dtype=numpy.uint8)
+    if bitMatrix.size > 0:
+        b.write(numpy.packbits(bitMatrix.ravel(), bitorder='little').tobytes())
+
+# Splits every value of an array into bitCount bits, as rows going from the least to the most significant bit
+def get_bits(values, bitCount):
+    return ((values[:, numpy.newaxis] >> numpy.arange(bitCount)) & 1).astype(numpy.uint8)
 
 """
 def write_transform(b, nat):
@@ -569,6 +594,13 @@ def write_transform(b, nat):
 
 def write_track_from_nat(b, nat, compression):
     nat.dataOffset = b.tell()
+    if nat.rawData is not None:
+        # The flags and frame count were taken from the imported track along with its data
+        b.write(nat.rawData)
+        nat.dataSize = len(nat.rawData)
+        pad(b, 0x64)
+        return
+
     nat.frameCount = len(nat.animationTrack)
 
     if ((nat.flags & 0x00ff) == AnimTrackFlags.Transform.value):
@@ -581,25 +613,22 @@ def write_track_from_nat(b, nat, compression):
             write_uncompressed_tranform(b, nat)
 
     elif ((nat.flags & 0x00ff) == AnimTrackFlags.Float.value):
-        for af in nat.animationTrack:
-            write_float(b,af)
+        b.write(numpy.asarray(nat.animationTrack, dtype=numpy.float64).astype('<f4').tobytes())
         if (nat.frameCount == 1):
             nat.flags |= AnimTrackFlags.Constant.value
         else:
             nat.flags |= AnimTrackFlags.Direct.value
 
     elif ((nat.flags & 0x00ff) == AnimTrackFlags.Boolean.value):
-        for af in nat.animationTrack:
-            write_byte(b,af)
+        b.write(numpy.asarray(nat.animationTrack, dtype=numpy.uint8).tobytes())
         if (nat.frameCount == 1):
             nat.flags |= AnimTrackFlags.Constant.value
         else:
             nat.flags |= AnimTrackFlags.Direct.value
 
     elif (nat.flags & 0x00ff) == AnimTrackFlags.Vector.value:
-        for af in nat.animationTrack:
-            for i in af: #[0, 1 , 2 , 3] Should be a vector of 4 values
-                write_float(b, i)
+        # Every frame should be a vector of 4 values
+        b.write(numpy.asarray(nat.animationTrack, dtype=numpy.float64).astype('<f4').tobytes())
         if (nat.frameCount == 1):
             nat.flags |= AnimTrackFlags.Constant.value
         else:
@@ -626,6 +655,15 @@ def gather_camera_groups(context):
 
     # Make NodeAnimTrack
     tnat = tn.nodeAnimTrack
+    tnat.flags |= AnimTrackFlags.Transform.value
+    tnat.type = "Transform"
+
+    # Field of view changes throughout an animation, proper keyframing is planned
+    fnat = NodeAnimTrack()
+    fnat.flags |= AnimTrackFlags.Float.value
+    fnat.type = "FieldOfView"
+
+    # The transform and field of view are both sampled while each frame is set
     for f in range(sce.frame_start, sce.frame_end):
         sce.frame_set(f)
         sx = c.scale[0]; sy = c.scale[1]; sz = c.scale[2]
@@ -635,8 +673,7 @@ def gather_camera_groups(context):
         rz = c.rotation_quaternion[3]
         px = c.location[0]; py = c.location[1]; pz = c.location[2]
         tnat.animationTrack.append([[sx, sy, sz, 1], [rx, ry, rz, rw], [px, py, pz, 1]])
-        tnat.flags |= AnimTrackFlags.Transform.value
-        tnat.type = "Transform"
+        fnat.animationTrack.append(c["FOV"]) # Todo: Figure out FOV conversion, don't hardcode this value
 
     tn.nodeAnimTrack = tnat
     tg.nodes.append(tn)
@@ -662,14 +699,7 @@ def gather_camera_groups(context):
     cnat.type = "FarClip"
     csnFarClip.nodeAnimTrack = cnat
 
-    # Field of view changes throughout an animation, proper keyframing is planned
-    cnat = csnFieldOfView.nodeAnimTrack
-    cnat.flags |= AnimTrackFlags.Float.value
-    cnat.type = "FieldOfView"
-    for f in range(sce.frame_start, sce.frame_end):
-        sce.frame_set(f)
-        cnat.animationTrack.append(c["FOV"]) # Todo: Figure out FOV conversion, don't hardcode this value
-    csnFieldOfView.nodeAnimTrack = cnat
+    csnFieldOfView.nodeAnimTrack = fnat
 
     # NearClip seems to be the same value in all investigated tracks
     cnat = csnNearClip.nodeAnimTrack
@@ -689,12 +719,290 @@ def gather_camera_groups(context):
     groups.append(cg)
     return groups
 
-def gather_groups(context):
+# Groups the fcurves of an action by the bone that they animate
+def get_bone_fcurves(action):
+    boneFCurves = {}
+    for fcurve in action.fcurves:
+        if fcurve.data_path.startswith('pose.bones["'):
+            boneFCurves.setdefault(fcurve.data_path[12:fcurve.data_path.index('"]')], []).append(fcurve)
+    return boneFCurves
+
+# Bones whose pose changes what a bone exports as, besides the bone itself. A bone that doesn't inherit scale is
+# exported relative to its parent's scaled pose, so the scale of its parent, and of every bone that the parent
+# inherits scale from, counts too
+def get_scale_parents(bone):
+    parents = []
+    if bone.inherit_scale == 'NONE':
+        parent = bone.parent
+        while parent is not None:
+            parents.append(parent)
+            if parent.inherit_scale != 'FULL':
+                break
+            parent = parent.parent
+    return parents
+
+# The same checksum that the importer stores for every bone it keys: the keyframes of the bone and of its scale
+# parents, the bone's inheritance settings and rotation mode, and its rest pose and that of its parent
+def get_bone_checksum(obj, boneName, boneFCurves):
+    digest = hashlib.sha1()
+    bone = obj.data.bones[boneName]
+    digest.update(("%s:%s:%d:%d" % (bone.inherit_scale, obj.pose.bones[boneName].rotation_mode, bone.use_inherit_rotation, bone.use_local_location)).encode('utf-8'))
+    digest.update(numpy.array(bone.matrix_local, dtype=numpy.float32).tobytes())
+    if bone.parent:
+        digest.update(numpy.array(bone.parent.matrix_local, dtype=numpy.float32).tobytes())
+    for name in [boneName] + [parent.name for parent in get_scale_parents(bone)]:
+        for fcurve in sorted(boneFCurves.get(name, []), key=lambda fcurve: (fcurve.data_path, fcurve.array_index)):
+            digest.update(("%s[%d]" % (fcurve.data_path, fcurve.array_index)).encode('utf-8'))
+            for attribute, width, dtype in (("co", 2, numpy.float32), ("handle_left", 2, numpy.float32), ("handle_right", 2, numpy.float32), ("interpolation", 1, numpy.int32)):
+                values = numpy.zeros(len(fcurve.keyframe_points) * width, dtype=dtype)
+                fcurve.keyframe_points.foreach_get(attribute, values)
+                digest.update(values.tobytes())
+    return digest.hexdigest()
+
+# The first and last frame that an action was imported over, from the markers that the importer puts on it
+def get_import_frame_range(action):
+    start = end = None
+    for marker in action.pose_markers:
+        if marker.name.endswith("-start"):
+            start = marker.frame
+        elif marker.name.endswith("-end"):
+            end = marker.frame
+    return start, end
+
+# Returns the track that a bone was imported from, when the bone hasn't been edited since and the track still fits
+# what's being exported; such a track is copied as it is, instead of being sampled and encoded again
+def get_passthrough_track(obj, b, rawTracks, boneFCurves, frameCount, compression):
+    raw = rawTracks.get(b.name)
+    if raw is None:
+        return None
+    # Anything but the keyframes of the bone and its scale parents moving it isn't part of the checksum
+    bones = [b] + [obj.pose.bones[parent.name] for parent in get_scale_parents(b.bone)]
+    if any(len(pb.constraints) > 0 for pb in bones):
+        return None
+    if any(fcurve.mute or len(fcurve.modifiers) > 0 for pb in bones for fcurve in boneFCurves.get(pb.name, [])):
+        return None
+    encoding = raw["flags"] & 0xff00
+    if encoding == AnimTrackFlags.Compressed.value and not compression:
+        return None
+    # Constant tracks hold for the whole animation, whatever its length
+    if raw["frameCount"] != frameCount and encoding not in (AnimTrackFlags.Constant.value, AnimTrackFlags.ConstTransform.value):
+        return None
+    if raw["checksum"] != get_bone_checksum(obj, b.name, boneFCurves):
+        return None
+    return raw
+
+# Samples the nodes of gather_groups by setting every frame on the scene, which works whatever moves the armature
+def sample_scene(sce, obj, sampledBones, sampledChildren, sampledProperties, frames):
+    # The pose matrix of every bone is captured on every frame, shaped (frames, bones, 16); Blender hands
+    # matrices over column by column
+    boneIndices = {b.name: i for i, b in enumerate(obj.pose.bones)}
+    poses = numpy.empty((len(frames), len(boneIndices) * 16), dtype=numpy.float32)
+    for i, f in enumerate(frames):
+        sce.frame_set(f)
+        obj.pose.bones.foreach_get('matrix', poses[i])
+
+        for child, nat in sampledChildren:
+            isVisible = not child.hide_render
+            nat.animationTrack.append(isVisible)
+
+        for k, nat in sampledProperties:
+            v = obj[k]
+            if "Vector" in nat.type:
+                nat.animationTrack.append([ v[0], v[1], v[2], v[3] ])
+            else:
+                nat.animationTrack.append(v)
+
+    if sampledBones:
+        poses = poses.reshape(len(frames), len(boneIndices), 4, 4).transpose(0, 1, 3, 2).astype(numpy.float64)
+        # Bones are made relative to their parents all at once, then every track is split into frames at once
+        rm = poses[:, [boneIndices[b.name] for b, nat in sampledBones]] #"Relative Matrix"
+        parented = [i for i, (b, nat) in enumerate(sampledBones) if b.parent]
+        if parented:
+            parentPoses = poses[:, [boneIndices[sampledBones[i][0].parent.name] for i in parented]]
+            rm[:, parented] = numpy.linalg.inv(parentPoses) @ rm[:, parented]
+        tracks = matrices_to_track(rm.transpose(1, 0, 2, 3))
+        for (b, nat), track in zip(sampledBones, tracks):
+            nat.animationTrack = track.tolist()
+
+# ==== Direct fcurve sampling ====
+# Most exported armatures are only moved by their action. Their poses can then be worked out from the fcurves
+# of the action alone, which is much faster than having the scene evaluate every frame
+
+# Turns quaternions, as rows of [W, X, Y, Z], into rotation matrices
+def quaternions_to_matrices(q):
+    lengths = numpy.linalg.norm(q, axis=-1, keepdims=True)
+    q = numpy.where(lengths > 0, q / numpy.where(lengths > 0, lengths, 1), [1.0, 0.0, 0.0, 0.0])
+    w, x, y, z = q[..., 0], q[..., 1], q[..., 2], q[..., 3]
+    m = numpy.empty(q.shape[:-1] + (3, 3))
+    m[..., 0, 0] = 1 - 2 * (y * y + z * z); m[..., 0, 1] = 2 * (x * y - z * w); m[..., 0, 2] = 2 * (x * z + y * w)
+    m[..., 1, 0] = 2 * (x * y + z * w); m[..., 1, 1] = 1 - 2 * (x * x + z * z); m[..., 1, 2] = 2 * (y * z - x * w)
+    m[..., 2, 0] = 2 * (x * z - y * w); m[..., 2, 1] = 2 * (y * z + x * w); m[..., 2, 2] = 1 - 2 * (x * x + y * y)
+    return m
+
+# Turns rotation matrices into quaternions, as rows of [W, X, Y, Z] with W >= 0. Every matrix is converted
+# with Shepperd's method: the component with the largest square is taken from the diagonal, and the other
+# three from the off-diagonal sums and differences divided by it, which keeps their signs right for any angle
+def matrices_to_quaternions(m):
+    m00, m11, m22 = m[..., 0, 0], m[..., 1, 1], m[..., 2, 2]
+    trace = m00 + m11 + m22
+    largest = numpy.argmax(numpy.stack((trace, m00, m11, m22), axis=-1), axis=-1)
+    q = numpy.empty(m.shape[:-2] + (4,))
+    # Largest component: W, X, Y and Z in turn
+    for i, (s, a, b, c) in enumerate((
+            (1 + trace, m[..., 2, 1] - m[..., 1, 2], m[..., 0, 2] - m[..., 2, 0], m[..., 1, 0] - m[..., 0, 1]),
+            (1 + m00 - m11 - m22, m[..., 2, 1] - m[..., 1, 2], m[..., 0, 1] + m[..., 1, 0], m[..., 0, 2] + m[..., 2, 0]),
+            (1 - m00 + m11 - m22, m[..., 0, 2] - m[..., 2, 0], m[..., 0, 1] + m[..., 1, 0], m[..., 1, 2] + m[..., 2, 1]),
+            (1 - m00 - m11 + m22, m[..., 1, 0] - m[..., 0, 1], m[..., 0, 2] + m[..., 2, 0], m[..., 1, 2] + m[..., 2, 1]))):
+        mask = largest == i
+        if not mask.any():
+            continue
+        r = numpy.sqrt(numpy.maximum(s[mask], 1e-12)) * 2
+        others = [(a[mask] / r), (b[mask] / r), (c[mask] / r)]
+        # Order of the components that aren't the largest one, as indices of [W, X, Y, Z]
+        order = [j for j in range(4) if j != i]
+        q[mask, i] = r / 4
+        for j, value in zip(order, others):
+            q[mask, j] = value
+    return q * numpy.where(q[..., :1] < 0, -1.0, 1.0)
+
+# Splits parent relative matrices, shaped (..., frames, 4, 4), into the frames of transform tracks, shaped
+# (..., frames, 3, 4); every quaternion is kept in the same hemisphere as the one of the frame before it
+def matrices_to_track(matrices):
+    scale = numpy.linalg.norm(matrices[..., :3, :3], axis=-2)
+    quaternions = matrices_to_quaternions(matrices[..., :3, :3] / numpy.where(scale > 0, scale, 1)[..., numpy.newaxis, :])
+    flips = numpy.einsum('...ij,...ij->...i', quaternions[..., 1:, :], quaternions[..., :-1, :]) < 0
+    quaternions[..., 1:, :] *= numpy.cumprod(numpy.where(flips, -1.0, 1.0), axis=-1)[..., numpy.newaxis]
+    track = numpy.ones(matrices.shape[:-2] + (3, 4))
+    track[..., 0, :3] = scale
+    track[..., 1, :3] = quaternions[..., 1:]
+    track[..., 1, 3] = quaternions[..., 0]
+    track[..., 2, :3] = matrices[..., :3, 3]
+    return track
+
+# Whether nothing but its action moves an object: no drivers, and no NLA tracks playing on top of the action
+def is_action_driven(idBlock):
+    ad = idBlock.animation_data
+    if ad is None:
+        return True
+    if len(ad.drivers) > 0 or getattr(ad, "action_influence", 1.0) != 1.0:
+        return False
+    return not (ad.use_nla and any(not track.mute for track in ad.nla_tracks))
+
+# Whether the poses of an armature, and the visibility of its children, can be worked out from fcurves alone.
+# Bone constraints, and bone settings that change how a parent's pose is inherited, need the scene to be sampled
+def can_sample_fcurves(obj, children):
+    if not is_action_driven(obj):
+        return False
+    for b in obj.pose.bones:
+        if len(b.constraints) > 0 or b.rotation_mode != 'QUATERNION':
+            return False
+        if b.bone.inherit_scale not in ('FULL', 'NONE') or not b.bone.use_inherit_rotation or not b.bone.use_local_location:
+            return False
+    return all(is_action_driven(child) for child in children)
+
+# Returns the fcurves of an action that take part in evaluating it, as a dict of {(data path, index), fcurve}
+def get_fcurve_channels(action):
+    if action is None:
+        return {}
+    return {(fcurve.data_path, fcurve.array_index): fcurve for fcurve in action.fcurves if not fcurve.mute}
+
+# Returns the value of every channel of a property on every frame, shaped (frames, channels): from its fcurves
+# when it's animated, and the value it has now otherwise
+def evaluate_channels(channels, dataPath, current, frames):
+    values = numpy.empty((len(frames), len(current)))
+    for i, value in enumerate(current):
+        fcurve = channels.get((dataPath, i))
+        values[:, i] = [fcurve.evaluate(f) for f in frames] if fcurve else value
+    return values
+
+# Works out the armature space pose matrix of every bone on every frame, shaped (frames, 4, 4), the same way
+# that Blender does for bones that inherit scale fully or not at all. Returns None when a parent's pose is
+# sheared, since removing its scale then needs more than normalizing its axes
+def evaluate_pose_matrices(obj, channels, frames):
+    poses = {}
+    for b in sorted(obj.pose.bones, key=lambda b: len(b.parent_recursive)):
+        path = 'pose.bones["%s"].' % b.name
+        location = evaluate_channels(channels, path + "location", b.location, frames)
+        basis = numpy.zeros((len(frames), 4, 4))
+        basis[:, :3, :3] = quaternions_to_matrices(evaluate_channels(channels, path + "rotation_quaternion", b.rotation_quaternion, frames))
+        basis[:, :3, :3] *= evaluate_channels(channels, path + "scale", b.scale, frames)[:, numpy.newaxis, :]
+        basis[:, :3, 3] = location
+        basis[:, 3, 3] = 1
+        if not b.parent:
+            poses[b.name] = numpy.array(b.bone.matrix_local) @ basis
+            continue
+
+        parentPose = poses[b.parent.name]
+        offset = numpy.linalg.inv(numpy.array(b.parent.bone.matrix_local)) @ numpy.array(b.bone.matrix_local)
+        if b.bone.inherit_scale == 'FULL':
+            poses[b.name] = parentPose @ offset @ basis
+            continue
+
+        # The parent's scale is removed from the rotation and scale of the bone, but not from its location
+        axes = numpy.linalg.norm(parentPose[:, :3, :3], axis=1)
+        normalized = parentPose[:, :3, :3] / numpy.where(axes > 0, axes, 1)[:, numpy.newaxis, :]
+        shear = numpy.abs(numpy.einsum('fij,fik->fjk', normalized, normalized) - numpy.eye(3))
+        if shear.max(initial=0) > 1e-4:
+            return None
+        unscaled = parentPose.copy()
+        unscaled[:, :3, :3] = normalized
+        pose = unscaled @ offset @ basis
+        locationMatrix = parentPose @ offset
+        pose[:, :3, 3] = numpy.einsum('fij,fj->fi', locationMatrix[:, :3, :3], location) + locationMatrix[:, :3, 3]
+        poses[b.name] = pose
+    return poses
+
+# Samples the nodes of gather_groups from fcurves, without setting any frame on the scene.
+# Returns False, with nothing sampled, when the poses can't be worked out this way
+def sample_fcurves(obj, sampledBones, sampledChildren, sampledProperties, frames):
+    action = obj.animation_data.action if obj.animation_data else None
+    channels = get_fcurve_channels(action)
+    poses = evaluate_pose_matrices(obj, channels, frames) if sampledBones else {}
+    if poses is None:
+        return False
+
+    for b, nat in sampledBones:
+        rm = poses[b.name]
+        if b.parent:
+            rm = numpy.linalg.inv(poses[b.parent.name]) @ rm
+        nat.animationTrack = matrices_to_track(rm).tolist()
+
+    for child, nat in sampledChildren:
+        childAction = child.animation_data.action if child.animation_data else None
+        hidden = evaluate_channels(get_fcurve_channels(childAction), "hide_render", [child.hide_render], frames)[:, 0]
+        nat.animationTrack = [not h for h in (hidden >= 0.5).tolist()]
+
+    for k, nat in sampledProperties:
+        v = obj[k]
+        current = [v[0], v[1], v[2], v[3]] if "Vector" in nat.type else [v]
+        values = evaluate_channels(channels, '["%s"]' % k, current, frames)
+        if "Vector" in nat.type:
+            nat.animationTrack = values.tolist()
+        elif "Boolean" in nat.type:
+            nat.animationTrack = (values[:, 0] >= 0.5).tolist()
+        else:
+            nat.animationTrack = values[:, 0].tolist()
+    return True
+
+def gather_groups(context, compression):
     # Blender Setup
     obj = bpy.context.object
     sce = bpy.context.scene
     # Groups Setup
     groups = []
+    # Tracks stored by the importer, for the bones of the action that were imported from a file
+    action = obj.animation_data.action if obj.animation_data else None
+    rawTracks = action.get("NUANMB Tracks", {}) if action else {}
+    # They only stand in for the animation when nothing but the action moves the armature, over the same frames
+    if rawTracks and not (is_action_driven(obj) and is_action_driven(obj.data) and
+                          get_import_frame_range(action) == (sce.frame_start, sce.frame_end)):
+        rawTracks = {}
+    boneFCurves = get_bone_fcurves(action) if rawTracks else {}
+    # Every node is set up first, so that all of them can be sampled while each frame is set just once
+    # Structure of these lists is: [(what gets sampled, NodeAnimTrack)]
+    sampledBones = []
+    sampledChildren = []
+    sampledProperties = []
     # Make Transform group
     tg = Group()
     tg.nodesAnimType = AnimType.Transform.value
@@ -712,34 +1020,13 @@ def gather_groups(context):
         nat = tn.nodeAnimTrack
         nat.flags |= AnimTrackFlags.Transform.value
         nat.type = "Transform"
-        pfq = 0 # Previous Frame Quaternion
-        for f in range(sce.frame_start, sce.frame_end):
-            sce.frame_set(f)
-            if not b.parent:
-                t = b.matrix.to_translation()
-                r = b.matrix.to_quaternion()
-                if f != sce.frame_start:
-                    if pfq.dot(r) < 0:
-                        r.negate()  #fix for quaternion interpolation
-                s = b.matrix.to_scale()
-                nat.animationTrack.append([ [s[0], s[1], s[2], 1],
-                                            [r[1], r[2], r[3], r[0]],
-                                            [t[0], t[1], t[2], 1] ])
-                pfq = r.copy()
-            else:
-                pmi = b.parent.matrix.inverted()
-                rm = pmi @ b.matrix #"Relative Matrix", might rename this later
-                t = rm.to_translation()
-                r = rm.to_quaternion()
-                if f != sce.frame_start:
-                    if pfq.dot(r) < 0:
-                        r.negate()
-                s = rm.to_scale()
-                nat.animationTrack.append([ [s[0], s[1], s[2], 1],
-                                            [r[1], r[2], r[3], r[0]],
-                                            [t[0], t[1], t[2], 1] ])
-                pfq = r.copy()
-        tn.nodeAnimTrack = nat
+        raw = get_passthrough_track(obj, b, rawTracks, boneFCurves, sce.frame_end - sce.frame_start, compression)
+        if raw is not None:
+            nat.flags = raw["flags"]
+            nat.frameCount = raw["frameCount"]
+            nat.rawData = bytes(raw["data"])
+        else:
+            sampledBones.append((b, nat))
         tg.nodes.append(tn)
     tg.nodes.sort(key = lambda node: node.name)
     groups.append(tg)
@@ -759,11 +1046,7 @@ def gather_groups(context):
         nat = n.nodeAnimTrack
         nat.flags |= AnimTrackFlags.Boolean.value
         nat.type = "Visibility"
-        for f in range(sce.frame_start, sce.frame_end):
-            sce.frame_set(f)
-            isVisible = not child.hide_render
-            nat.animationTrack.append(isVisible)
-        n.nodeAnimTrack = nat
+        sampledChildren.append((child, nat))
         vg.nodes.append(n)
     vg.nodes.sort(key = lambda node: node.name)
     groups.append(vg)
@@ -773,7 +1056,7 @@ def gather_groups(context):
     mg.nodesAnimType = AnimType.Material.value
     # Make Material Nodes and subnodes
     nodeNames = []
-    for k, v in obj.items(): # Key, Value. Key Format for materials should be nat.name:nat.type
+    for k in obj.keys(): # Key Format for materials should be nat.name:nat.type
         if ":" not in k:
             continue
         nodeName = k.split(":")[0]
@@ -795,24 +1078,22 @@ def gather_groups(context):
             print("Unknown nodeType: " + str(nodeType));
             continue
         nat.type = nodeType
-        if "Vector" in nodeType:
-            for f in range(sce.frame_start, sce.frame_end):
-                sce.frame_set(f)
-                nat.animationTrack.append([ v[0], v[1], v[2], v[3] ])
-        else:
-            for f in range(sce.frame_start, sce.frame_end):
-                sce.frame_set(f)
-                nat.animationTrack.append(v)
-        msn.nodeAnimTrack = nat
+        sampledProperties.append((k, nat))
         for node in mg.nodes:
             if node.name == nodeName:
                 node.materialSubNodes.append(msn)
 
     groups.append(mg)
 
+    # Armatures that only their action moves don't need the scene to be evaluated on every frame
+    frames = range(sce.frame_start, sce.frame_end)
+    if not (can_sample_fcurves(obj, [child for child, nat in sampledChildren]) and
+            sample_fcurves(obj, sampledBones, sampledChildren, sampledProperties, frames)):
+        sample_scene(sce, obj, sampledBones, sampledChildren, sampledProperties, frames)
+
     return groups
 
-def export_nuanmb_main(context, filepath, compression):
+def export_nuanmb_main(context, filepath, compression, use_track_cache=False):
     print(str(filepath))
     fileName = os.path.basename(filepath)
     print(str(fileName))
@@ -822,9 +1103,9 @@ def export_nuanmb_main(context, filepath, compression):
         compression = False # Smash Camera Anims are not compressed
         groups = gather_camera_groups(context)
     else:
-        groups = gather_groups(context)
+        groups = gather_groups(context, compression)
 
-    animBuffer = make_anim_buffer(context, groups, compression)
+    animBuffer = make_anim_buffer(context, groups, compression, filepath + ".tracks.npz" if use_track_cache else None)
 
     s = bpy.context.scene
     finalFrameIndex = s.frame_end - s.frame_start - 1
@@ -859,8 +1140,14 @@ class NUANMB_Export_Operator(bpy.types.Operator, ExportHelper):
         default=True,
     )
 
+    use_track_cache: bpy.props.BoolProperty(
+        name="Keep Track Cache",
+        description="Keep the encoded tracks in a file next to the exported file, so that exporting it again in a later session only encodes the tracks that changed",
+        default=False,
+    )
+
     def execute(self, context):
-        return export_nuanmb_main(context, self.filepath, self.compression)
+        return export_nuanmb_main(context, self.filepath, self.compression, self.use_track_cache)
 
     @classmethod
     def poll(self, context):